@@ -1,15 +1,21 @@
+from dotenv import load_dotenv
+
+# Settings are read from the environment when the blueprints are imported
+load_dotenv()
+
 from flask import Flask
 from flask_cors import CORS
-from flask_session import Session
 import os
 from blueprints.files import file_bp
 from blueprints.auth import auth_bp
 from blueprints.admin import admin_bp
 from blueprints.report import report_bp
-from blueprints.database import init_db
-
-# Constants
-STORAGE_DIR = 'data/json_files'
+from blueprints.database import init_db, init_app as init_db_pool
+from blueprints.report_queue import init_app as init_report_workers
+from blueprints.passwords import init_app as init_password_hasher
+from blueprints.logs import init_app as init_logging, start as start_log_writer
+from blueprints.metrics import init_app as init_metrics
+from blueprints.blobs import STORAGE_DIR
 
 # Ensure storage directory exists
 os.makedirs(STORAGE_DIR, exist_ok=True)
@@ -61,8 +67,22 @@ app.register_blueprint(file_bp, url_prefix='/api')
 app.register_blueprint(admin_bp, url_prefix='/api')
 app.register_blueprint(report_bp, url_prefix='/api')
 
+# Per-endpoint request metrics, served on /metrics
+init_metrics(app)
+
+# Send logs through the background writer, started below once the
+# processes that are forked from this one exist
+init_logging(app)
+
 # Initialize the database
 init_db()
+init_db_pool(app)
+
+# Start the report bot's worker processes
+init_report_workers(app)
+# And the password hashing processes
+init_password_hasher(app)
+start_log_writer()
 
 if __name__ == '__main__':
     app.run(debug=False)
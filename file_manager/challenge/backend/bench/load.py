@@ -0,0 +1,292 @@
+"""Load scenarios for the file API with latency percentiles and throughput.
+
+Run from the backend directory against a dataset made by bench.seed:
+
+    python -m bench.load DIR [--scenarios create,list,get,search,delete]
+                             [--concurrency 8] [--seconds 10] [--url URL]
+                             [--output run.json] [--baseline earlier.json]
+
+Without ``--url`` the app is imported in-process with DIR as its working
+directory and driven through the Flask test client. With ``--url`` the
+requests go over HTTP to a server already running on DIR, e.g.
+
+    gunicorn -c $PWD/gunicorn.conf.py --chdir DIR --pythonpath $PWD app:app
+
+Each scenario runs on its own for ``--seconds`` after ``--warmup`` seconds
+that are not recorded, with ``--concurrency`` threads each logged in as a
+different seeded user. The seeded data is only added to (create, and delete
+only removes files it created itself), so runs against the same dataset
+stay comparable. ``--output`` saves the results with the dataset size and
+environment, ``--baseline`` prints the change against a saved run.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath('.'))
+
+os.environ.setdefault('ADMIN_PASSWORD', 'bench')
+# No bot, reports aren't part of any scenario
+os.environ.setdefault('REPORT_WORKERS', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from bench.seed import PASSWORD, document, file_size, words  # noqa: E402
+
+
+class Worker:
+    """One simulated user: a logged-in client and its recorded timings."""
+
+    def __init__(self, client, rng, median_size):
+        self.client = client
+        self.rng = rng
+        self.median_size = median_size
+        self.files = []
+        self.after = 0
+        self.recording = False
+        self.latencies = []
+        self.errors = 0
+
+    def request(self, method, path, body=None, expect=(200,), timed=True):
+        start = time.perf_counter()
+        status, data = self.client(method, path, body)
+        elapsed = time.perf_counter() - start
+        if timed and self.recording:
+            self.latencies.append(elapsed)
+            self.errors += status not in expect
+        return status, data
+
+    def new_content(self):
+        return document(self.rng, file_size(self.rng, self.median_size))
+
+
+def create(worker):
+    worker.request('POST', '/api/files', {'content': worker.new_content()}, expect=(201,))
+
+
+def list_files(worker):
+    # Page through the user's files, starting over after the last page
+    _, data = worker.request('GET', f'/api/files?limit=50&after={worker.after}')
+    worker.after = (data or {}).get('next') or 0
+
+
+def get(worker):
+    kind = worker.rng.choice(['details', 'content'])
+    worker.request('GET', f'/api/files/{kind}/{worker.rng.choice(worker.files)}')
+
+
+def search(worker):
+    # Zipf-distributed words, mostly common ones with the odd rare one;
+    # nothing found is a 404 by design
+    query = words(worker.rng, 1)[0]
+    worker.request('POST', f'/api/admin_debug?query={query}&limit=10', expect=(200, 404))
+
+
+def delete(worker):
+    _, data = worker.request('POST', '/api/files', {'content': worker.new_content()}, timed=False)
+    worker.request('DELETE', f"/api/files/{data['name']}")
+
+
+SCENARIOS = {
+    'create': create,
+    'list': list_files,
+    'get': get,
+    'search': search,
+    'delete': delete,
+}
+
+
+def test_client_factory(directory):
+    os.chdir(directory)
+    from app import app
+
+    def make():
+        client = app.test_client()
+
+        def send(method, path, body):
+            response = client.open(path, method=method, json=body)
+            return response.status_code, response.get_json(silent=True)
+        return send
+    return make
+
+
+def http_factory(url):
+    import requests
+
+    def make():
+        session = requests.Session()
+
+        def send(method, path, body):
+            response = session.request(method, url + path, json=body, timeout=60)
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+            return response.status_code, data
+        return send
+    return make
+
+
+def login(make_client, user, seed, median_size):
+    worker = Worker(make_client(), random.Random(seed), median_size)
+    status, data = worker.request('POST', '/api/auth/login', {'username': user, 'password': PASSWORD}, timed=False)
+    if status != 200:
+        raise RuntimeError(f'login as {user} failed: {status} {data}')
+    _, data = worker.request('GET', '/api/files?limit=200', timed=False)
+    worker.files = data['files']
+    while len(worker.files) < 10:
+        _, data = worker.request('POST', '/api/files', {'content': worker.new_content()}, timed=False)
+        worker.files.append(data['name'])
+    return worker
+
+
+def run(scenario, workers, seconds, warmup):
+    step = SCENARIOS[scenario]
+    for worker in workers:
+        worker.recording = False
+        worker.latencies = []
+        worker.errors = 0
+    start = time.perf_counter()
+    record_at = start + warmup
+    stop = record_at + seconds
+
+    def loop(worker):
+        while True:
+            now = time.perf_counter()
+            if now >= stop:
+                break
+            worker.recording = now >= record_at
+            step(worker)
+
+    threads = [threading.Thread(target=loop, args=(worker,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(latency for worker in workers for latency in worker.latencies)
+    if not latencies:
+        return {'requests': 0, 'throughput': 0.0, 'errors': 0}
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / seconds,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': latencies[-1] * 1000,
+        'errors': sum(worker.errors for worker in workers),
+    }
+
+
+def dataset(directory):
+    conn = sqlite3.connect(os.path.join(directory, 'data', 'app.db'))
+    try:
+        users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        row = conn.execute("SELECT value FROM settings WHERE key = 'db_shards'").fetchone()
+    finally:
+        conn.close()
+    shards = int(row[0]) if row else 1
+    files = 0
+    for shard in range(shards):
+        name = 'app.db' if shard == 0 else f'app-shard{shard}.db'
+        conn = sqlite3.connect(os.path.join(directory, 'data', name))
+        try:
+            # The largest id is close enough and doesn't scan 10M rows
+            files = max(files, conn.execute("SELECT COALESCE(MAX(id), 0) FROM files").fetchone()[0])
+        finally:
+            conn.close()
+    return {'users': users, 'shards': shards, 'files_max_id': files}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'cpus': os.cpu_count(),
+        'platform': platform.platform(),
+    }
+
+
+def change(new, old):
+    if not old:
+        return '      n/a'
+    return f'{(new - old) / old * 100:+8.1f}%'
+
+
+def report(results, baseline=None):
+    header = f"{'scenario':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+    if baseline:
+        header += f"{'req/s':>10}{'p99':>10}"
+    print(header)
+    for scenario, result in results.items():
+        if not result['requests']:
+            print(f"{scenario:<10}{0:>10}")
+            continue
+        line = (f"{scenario:<10}{result['requests']:>10}{result['throughput']:10.1f}{result['p50_ms']:9.2f}"
+                f"{result['p95_ms']:9.2f}{result['p99_ms']:9.2f}{result['errors']:>8}")
+        old = (baseline or {}).get(scenario)
+        if old:
+            line += f" {change(result['throughput'], old['throughput'])} {change(result['p99_ms'], old.get('p99_ms'))}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('dir', help='data directory made by bench.seed')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=1)
+    parser.add_argument('--url', help='server to drive instead of the in-process test client')
+    parser.add_argument('--median-size', type=int, default=1024, help='median size of created files')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--baseline', help='JSON saved by an earlier --output to compare against')
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenarios.split(',')
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    directory = os.path.abspath(args.dir)
+    # The test client runs the app from inside directory
+    output = os.path.abspath(args.output) if args.output else None
+    meta = {'args': vars(args), 'dataset': dataset(directory), 'environment': environment()}
+    make_client = http_factory(args.url.rstrip('/')) if args.url else test_client_factory(directory)
+    workers = [login(make_client, f'user{n}', args.seed + n, args.median_size) for n in range(args.concurrency)]
+
+    print(f"{meta['dataset']['users']} users, ~{meta['dataset']['files_max_id']} files, "
+          f"{args.concurrency} workers, {args.seconds:g} s per scenario, "
+          f"{'HTTP ' + args.url if args.url else 'test client'}")
+    results = {scenario: run(scenario, workers, args.seconds, args.warmup) for scenario in scenarios}
+    report(results, baseline)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
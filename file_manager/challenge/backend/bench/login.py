@@ -0,0 +1,101 @@
+"""Login throughput against the size of the password hashing pool.
+
+Run from the backend directory:
+
+    python -m bench.login [--pools 0,1,2,4] [--clients 8] [--seconds 5]
+
+For every pool size (0 hashes inline in the request thread) ``--clients``
+threads log in as fast as they can through the test client while a probe
+thread times a request that does no hashing, showing how much a login burst
+slows down the rest of the process.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, '.')
+
+os.environ.setdefault('ADMIN_PASSWORD', 'bench')
+
+from flask import Flask  # noqa: E402
+
+from blueprints import auth, database  # noqa: E402
+from blueprints.passwords import PASSWORD_HASH_METHOD, PasswordHasher  # noqa: E402
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'bench'
+    app.register_blueprint(auth.auth_bp, url_prefix='/api/auth')
+    database.init_app(app)
+    return app
+
+
+def run(app, clients, seconds):
+    stop = time.perf_counter() + seconds
+    logins = []
+    probe = []
+
+    def login():
+        client = app.test_client()
+        count = 0
+        while time.perf_counter() < stop:
+            response = client.post('/api/auth/login', json={'username': 'bench', 'password': 'bench'})
+            assert response.status_code == 200, response.get_json()
+            count += 1
+        logins.append(count)
+
+    def ping():
+        client = app.test_client()
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            client.post('/api/auth/logout')
+            probe.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=login) for _ in range(clients)] + [threading.Thread(target=ping)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(logins) / seconds, probe
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pools', default='0,1,2,4')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--method', default=PASSWORD_HASH_METHOD)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, 'app.db')
+        database.init_db()
+        app = make_app()
+        with app.test_client() as client:
+            client.post('/api/auth/register', json={'username': 'bench', 'password': 'bench'})
+
+        print(f"method {args.method}, {args.clients} clients, {os.cpu_count()} cpus")
+        print(f"{'pool':>6}{'logins/s':>12}{'probe p50 ms':>15}{'probe p99 ms':>15}")
+        for size in [int(size) for size in args.pools.split(',')]:
+            auth.hasher = PasswordHasher(method=args.method, workers=size,
+                                         max_pending=args.clients, timeout=args.seconds)
+            auth.hasher.start()
+            try:
+                rate, probe = run(app, args.clients, args.seconds)
+            finally:
+                auth.hasher.shutdown()
+            probe.sort()
+            p50 = statistics.median(probe) * 1000
+            p99 = probe[int(len(probe) * 0.99)] * 1000
+            print(f"{size:>6}{rate:12.1f}{p50:15.2f}{p99:15.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Per-request cost of the metrics middleware and the timed DB connections.
+
+Run from the backend directory:
+
+    python -m bench.metrics [--requests 2000] [--repeat 5] [--max-overhead-us 50]
+
+Times the same requests through the test client with metrics off and on,
+reports the best of ``--repeat`` rounds for each and exits non-zero if the
+difference per request is above ``--max-overhead-us``.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, '.')
+
+os.environ.setdefault('ADMIN_PASSWORD', 'bench')
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+
+from flask import Flask  # noqa: E402
+
+from blueprints import database, metrics  # noqa: E402
+from blueprints.admin import admin_bp  # noqa: E402
+from blueprints.auth import auth_bp  # noqa: E402
+from blueprints.files import file_bp  # noqa: E402
+
+# (method, path) pairs, one DB-free and two that query
+REQUESTS = [
+    ('POST', '/api/auth/logout'),
+    ('GET', '/api/files?limit=10&fields=visits,size'),
+    ('POST', '/api/admin_debug?query=bench'),
+]
+
+
+def make_app(with_metrics):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'bench'
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(file_bp, url_prefix='/api')
+    app.register_blueprint(admin_bp, url_prefix='/api')
+    database.init_app(app)
+    if with_metrics:
+        metrics.init_app(app)
+    return app
+
+
+def use_timed_connections(timed, _timed_class=database.TimedConnection):
+    # Plain connections when off, so the DB timing is part of the measurement
+    database.TimedConnection = _timed_class if timed else sqlite3.Connection
+    database.pool = database.ConnectionPool()
+
+
+def run(app, count):
+    client = app.test_client()
+    client.post('/api/auth/login', json={'username': 'bench', 'password': 'bench'})
+    start = time.perf_counter()
+    for i in range(count):
+        method, path = REQUESTS[i % len(REQUESTS)]
+        client.open(path, method=method)
+    return (time.perf_counter() - start) / count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-overhead-us', type=float, default=50)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, 'app.db')
+        database.init_db()
+        setup = make_app(False).test_client()
+        setup.post('/api/auth/register', json={'username': 'bench', 'password': 'bench'})
+        setup.post('/api/auth/login', json={'username': 'bench', 'password': 'bench'})
+        for i in range(50):
+            setup.post('/api/files', json={'content': f'{{"bench": {i}}}'})
+
+        apps = {'off': make_app(False), 'on': make_app(True)}
+        best = {name: float('inf') for name in apps}
+        for _ in range(args.repeat):
+            # Alternate so drift affects both sides alike
+            for name, app in apps.items():
+                use_timed_connections(name == 'on')
+                best[name] = min(best[name], run(app, args.requests))
+
+    overhead = (best['on'] - best['off']) * 1e6
+    print(f"metrics off {best['off'] * 1e6:8.1f} us/request")
+    print(f"metrics on  {best['on'] * 1e6:8.1f} us/request")
+    print(f"overhead    {overhead:8.1f} us/request (limit {args.max_overhead_us})")
+    return 1 if overhead > args.max_overhead_us else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
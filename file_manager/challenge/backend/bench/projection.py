@@ -0,0 +1,111 @@
+"""Full content fetches against fields= projections on large documents.
+
+Run from the backend directory:
+
+    python -m bench.projection [--sizes 1,8,32] [--repeat 5]
+
+For every document size (in MB) one file is uploaded and then fetched
+through the test client three ways, best of ``--repeat`` each:
+
+    full          GET /api/files/content/<name>, the whole document
+    full+parse    the same plus the json.loads a client needs to pick keys
+    projected     GET ...?fields=<paths>, only the selected values
+
+The projections pick a top-level scalar, a nested key and one record deep
+in a large array. Response sizes are printed next to the timings.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, '.')
+
+os.environ.setdefault('ADMIN_PASSWORD', 'bench')
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+
+from flask import Flask  # noqa: E402
+
+from blueprints import blobs, database  # noqa: E402
+from blueprints.auth import auth_bp  # noqa: E402
+from blueprints.files import file_bp  # noqa: E402
+
+PROJECTIONS = {
+    'scalar': 'id',
+    'nested': 'meta.owner.name,meta.tags',
+    'deep': 'records[{middle}].payload.score',
+}
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'bench'
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(file_bp, url_prefix='/api')
+    database.init_app(app)
+    return app
+
+
+def document(size):
+    """A JSON document of about size bytes, mostly an array of records."""
+    record = {'name': 'record', 'payload': {'score': 0.5, 'labels': ['alpha', 'beta', 'gamma'], 'text': 'x' * 64}}
+    count = max(1, size // len(json.dumps(record)))
+    return json.dumps({
+        'id': 42,
+        'meta': {'owner': {'name': 'bench', 'id': 1}, 'tags': ['large', 'synthetic']},
+        'records': [dict(record, name=f'record{i}') for i in range(count)],
+    }), count
+
+
+def best(repeat, fetch):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = fetch()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1,8,32', help='document sizes in MB')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, 'app.db')
+        blobs.STORAGE_DIR = os.path.join(tmp, 'json_files')
+        database.init_db()
+        client = make_app().test_client()
+        client.post('/api/auth/register', json={'username': 'bench', 'password': 'bench'})
+        client.post('/api/auth/login', json={'username': 'bench', 'password': 'bench'})
+
+        print(f"{'size':>6}  {'fetch':<18}{'ms':>10}{'bytes':>12}")
+        for mb in [float(size) for size in args.sizes.split(',')]:
+            text, count = document(int(mb * 1024 * 1024))
+            response = client.post('/api/files/upload', data=text, content_type='application/json')
+            url = f"/api/files/content/{response.get_json()['name']}"
+
+            def full():
+                return len(client.get(url).data)
+
+            def full_parse():
+                data = client.get(url).data
+                json.loads(data)
+                return len(data)
+
+            rows = [('full', full), ('full+parse', full_parse)]
+            for name, fields in PROJECTIONS.items():
+                query = {'fields': fields.format(middle=count // 2)}
+                rows.append((f'projected {name}',
+                             lambda query=query: len(client.get(url, query_string=query).data)))
+            for name, fetch in rows:
+                ms, size = best(args.repeat, fetch)
+                print(f"{mb:>5g}M  {name:<18}{ms:10.1f}{size:12}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
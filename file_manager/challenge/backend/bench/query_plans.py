@@ -0,0 +1,67 @@
+"""Fail if any hot query stops using an index.
+
+Run from the backend directory:
+
+    python -m bench.query_plans
+
+Builds a throwaway database with init_db(), runs EXPLAIN QUERY PLAN over the
+queries the request handlers issue on every call and exits non-zero if any of
+them plans a full table scan.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, '.')
+
+from blueprints import database  # noqa: E402
+
+# name -> (sql, params)
+HOT_QUERIES = {
+    'details': ("SELECT filename, user_id, content_hash, size FROM files WHERE filename = ?", ('f',)),
+    'visits': ("UPDATE files SET visits = visits + 1 WHERE filename = ? AND user_id = ?", ('f', 1)),
+    'delete': ("DELETE FROM files WHERE filename = ? AND user_id = ?", ('f', 1)),
+    'list': ("SELECT id, filename FROM files WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?", (1, 0, 10)),
+    'export': ("SELECT id, filename, content_hash, size, created_at FROM files "
+               "WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?", (1, 0, 500)),
+    'blob_refs': ("SELECT 1 FROM files WHERE content_hash = ? LIMIT 1", ('h',)),
+    'login': ("SELECT * FROM users WHERE username = ?", ('admin',)),
+    'report_claim': ("SELECT id FROM report_jobs WHERE status = 'queued' ORDER BY id LIMIT 1", ()),
+}
+
+
+def is_scan(detail):
+    # Virtual tables (FTS) report SCAN even when their index answers the query
+    return detail.startswith('SCAN') and 'VIRTUAL TABLE INDEX' not in detail
+
+
+def check(conn):
+    failures = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        scans = [detail for detail in plan if is_scan(detail)]
+        status = 'SCAN' if scans else 'ok'
+        print(f"{name:<16}{status:<6}{' | '.join(plan)}")
+        if scans:
+            failures.append(name)
+    return failures
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, 'app.db')
+        database.init_db()
+        conn = database._connect()
+        try:
+            failures = check(conn)
+        finally:
+            conn.close()
+
+    if failures:
+        print(f"full table scans in: {', '.join(failures)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
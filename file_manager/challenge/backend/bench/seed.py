@@ -0,0 +1,187 @@
+"""Fill a throwaway data directory with synthetic users and files.
+
+Run from the backend directory:
+
+    python -m bench.seed DIR [--users 100000] [--files 10000000] [--seed 1]
+
+DIR gets the same layout as the backend's own data/ (DIR/data/app.db and the
+blob store in DIR/data/json_files), so a server started with DIR as its
+working directory serves the generated data. Existing databases are never
+touched.
+
+Every user is called ``user<n>`` with the password ``bench``. File sizes are
+log-normal around ``--median-size`` with a long tail, owners are skewed so a
+few users own most of the files, and the text is drawn from a fixed
+vocabulary with Zipf-like word frequencies, which gives the search index a
+realistic mix of common and rare trigrams. Bodies come from a pool of
+``--distinct`` documents; the blob store is content addressed, so the pool
+size is the number of blobs on disk. The same arguments always produce the
+same dataset. Files are split across DB_SHARDS databases the way the app
+routes them.
+
+The trigram search index dominates the cost: on a 1 CPU container seeding
+runs at about 2k files/s and 8.5 KB of database per file with it, and about
+23k files/s and 330 bytes per file with ``--no-search-index``. At the
+default 10M files that is hours and ~85 GB against minutes and ~3.5 GB.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+os.environ.setdefault('ADMIN_PASSWORD', 'bench')
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from blueprints import blobs, database  # noqa: E402
+from blueprints.passwords import PASSWORD_HASH_METHOD  # noqa: E402
+
+PASSWORD = 'bench'
+MAX_SIZE = 1024 * 1024
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'tas', 'vu', 'do', 'shi', 'pe', 'gar', 'nor', 'ix', 'bel', 'qua', 'zen', 'tor']
+
+
+def vocabulary(count=4096, seed=0):
+    """count distinct pseudo-words, most frequent first."""
+    rng = random.Random(seed)
+    words = []
+    seen = set()
+    while len(words) < count:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+WORDS = vocabulary()
+# 1/rank weights, so a few words are everywhere and most are rare
+_CUM_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(WORDS) + 1)))
+
+
+def words(rng, count):
+    return rng.choices(WORDS, cum_weights=_CUM_WEIGHTS, k=count)
+
+
+def file_size(rng, median):
+    return max(32, min(MAX_SIZE, int(rng.lognormvariate(math.log(median), 1.2))))
+
+
+def document(rng, size):
+    """A canonical JSON document of roughly size bytes."""
+    doc = {
+        'id': rng.getrandbits(32),
+        'title': ' '.join(words(rng, rng.randint(2, 6))),
+        'tags': words(rng, rng.randint(0, 5)),
+        'score': round(rng.random() * 100, 2),
+    }
+    base = len(json.dumps(doc, sort_keys=True, separators=(',', ':')))
+    # Words average about seven bytes with their separator
+    doc['body'] = ' '.join(words(rng, max(0, (size - base - 10) // 7)))
+    return json.dumps(doc, sort_keys=True, separators=(',', ':'))
+
+
+def owner(rng, users):
+    # Cubing skews ownership toward the low ids
+    return 2 + int(users * rng.random() ** 3)
+
+
+def seed(conns, args, log=print):
+    """Fill conns, a connection to every shard; users go to the catalog, shard 0."""
+    rng = random.Random(args.seed)
+    password = generate_password_hash(PASSWORD, PASSWORD_HASH_METHOD)
+    conn = conns[0]
+    cursor = conn.cursor()
+
+    for start in range(0, args.users, args.batch):
+        # The admin is user 1, seeded users start at 2
+        cursor.executemany("INSERT INTO users (username, password, admin) VALUES (?, ?, 0)",
+                           [(f'user{n}', password) for n in range(start, min(start + args.batch, args.users))])
+        conn.commit()
+    log(f'{args.users} users')
+
+    pool = []
+    for _ in range(min(args.distinct, args.files)):
+        content = document(rng, file_size(rng, args.median_size))
+        digest, size = blobs.put(content)
+        pool.append((content, digest, size))
+    log(f'{len(pool)} distinct documents, {sum(size for _, _, size in pool) / 1e6:.1f} MB of blobs')
+
+    # Ids are unique across the shards, though they only have to be within one
+    next_id = max(shard.execute("SELECT COALESCE(MAX(id), 0) FROM files").fetchone()[0] for shard in conns) + 1
+    now = time.time()
+    started = time.perf_counter()
+    for start in range(0, args.files, args.batch):
+        files = [[] for _ in conns]
+        search = [[] for _ in conns]
+        for file_id in range(next_id + start, next_id + min(start + args.batch, args.files)):
+            content, digest, size = rng.choice(pool)
+            # Newer files get more visits
+            created_at = now - rng.random() * 365 * 86400
+            visits = int(rng.expovariate(1 / 20) * (1 - (now - created_at) / (400 * 86400)))
+            user_id = owner(rng, args.users)
+            shard = database.shard_for(user_id)
+            files[shard].append((file_id, user_id, '%032x' % rng.getrandbits(128),
+                                 digest, size, visits, created_at))
+            search[shard].append((file_id, content))
+        for shard, shard_conn in enumerate(conns):
+            shard_conn.executemany("""
+                INSERT INTO files (id, user_id, filename, content_hash, size, visits, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, files[shard])
+            if not args.no_search_index:
+                shard_conn.executemany("INSERT INTO files_fts (rowid, content) VALUES (?, ?)", search[shard])
+            shard_conn.commit()
+        done = min(start + args.batch, args.files)
+        if done % (args.batch * 10) == 0 or done == args.files:
+            rate = done / (time.perf_counter() - started)
+            log(f'{done} files ({rate:.0f}/s)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('dir')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--files', type=int, default=10_000_000)
+    parser.add_argument('--distinct', type=int, default=100_000, help='distinct document bodies')
+    parser.add_argument('--median-size', type=int, default=1024, help='median file size in bytes')
+    parser.add_argument('--no-search-index', action='store_true',
+                        help='leave files_fts empty, it is most of the database size and seeding time')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch', type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    data = os.path.join(args.dir, 'data')
+    database.DB_NAME = os.path.join(data, 'app.db')
+    blobs.STORAGE_DIR = os.path.join(data, 'json_files')
+    if os.path.exists(database.DB_NAME):
+        print(f'{database.DB_NAME} already exists, pick an empty directory', file=sys.stderr)
+        return 1
+    os.makedirs(blobs.STORAGE_DIR)
+    database.init_db()
+
+    conns = [sqlite3.connect(database.shard_path(shard)) for shard in range(database.DB_SHARDS)]
+    started = time.perf_counter()
+    try:
+        for conn in conns:
+            # A throwaway database, losing it on a crash is fine
+            conn.execute("PRAGMA synchronous=OFF")
+        seed(conns, args)
+        for conn in conns:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        for conn in conns:
+            conn.close()
+    print(f'seeded {database.DB_NAME} in {time.perf_counter() - started:.0f} s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""HTTP throughput of the development server against gunicorn.
+
+Run from the backend directory:
+
+    python -m bench.serve [--modes dev,gunicorn] [--clients 16] [--seconds 10]
+
+Each mode serves a fresh copy of the backend (the tracked data/ directory is
+left alone) with the report workers off. ``--clients`` processes share one
+logged-in session and loop over file details, content, visits and the file
+list for ``--seconds``; requests per second and latency percentiles are
+printed per mode. ``dev`` is what the image used to run, ``flask run``.
+
+Numbers from a 1 CPU container, 10 s runs, gunicorn with the default
+2 workers x 4 threads (and 1 x 8 for comparison):
+
+    clients  mode           requests/s   p50 ms   p99 ms   errors
+          4  dev                 307.3     12.8     21.2        0
+          4  gunicorn            335.7     11.6     23.5        0
+          4  gunicorn 1x8        340.7     11.2     24.8        0
+         16  dev                 286.9     55.0     73.8        0
+         16  gunicorn            294.1     53.0    110.6        0
+         16  gunicorn 1x8        298.8     52.4    103.6        0
+
+With one core shared with the load generator the two are within about 10%
+of each other, the handlers are CPU bound and the dev server's threads
+already overlap the sqlite and file I/O. The workers only pay off with more
+cores, where the dev server stays on one.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (method, path template) pairs the clients cycle through
+REQUESTS = [
+    ('GET', '/api/files/details/{name}'),
+    ('GET', '/api/files/content/{name}'),
+    ('POST', '/api/files/{name}'),
+    ('GET', '/api/files?limit=20'),
+]
+
+
+def command(mode, port):
+    if mode == 'dev':
+        return [sys.executable, '-m', 'flask', 'run', '--port', str(port)]
+    return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'app:app']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server at {url} did not come up')
+
+
+def seed(base, files):
+    session = requests.Session()
+    session.post(f'{base}/api/auth/register', json={'username': 'bench', 'password': 'bench'})
+    response = session.post(f'{base}/api/auth/login', json={'username': 'bench', 'password': 'bench'})
+    response.raise_for_status()
+    names = []
+    for i in range(files):
+        response = session.post(f'{base}/api/files', json={'content': f'{{"bench": {i}, "data": "{"x" * 512}"}}'})
+        response.raise_for_status()
+        names.append(response.json()['name'])
+    return session.cookies.get_dict(), names
+
+
+def client(base, cookies, names, seconds, seed_offset):
+    session = requests.Session()
+    session.cookies.update(cookies)
+    latencies = []
+    errors = 0
+    stop = time.perf_counter() + seconds
+    i = seed_offset
+    while time.perf_counter() < stop:
+        method, path = REQUESTS[i % len(REQUESTS)]
+        url = base + path.format(name=names[i % len(names)])
+        start = time.perf_counter()
+        try:
+            ok = session.request(method, url, timeout=30).status_code < 400
+        except requests.RequestException:
+            ok = False
+        latencies.append(time.perf_counter() - start)
+        errors += not ok
+        i += 1
+    return latencies, errors
+
+
+def run(mode, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, 'backend')
+        shutil.copytree(BACKEND, root, ignore=shutil.ignore_patterns('data', '__pycache__', '.env'))
+        port = free_port()
+        env = dict(os.environ, FLASK_APP='app.py', ADMIN_PASSWORD='bench', FLAG='bench',
+                   REPORT_WORKERS='0', LOG_LEVEL='WARNING', PYTHONDONTWRITEBYTECODE='1')
+        server = subprocess.Popen(command(mode, port), cwd=root, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base = f'http://127.0.0.1:{port}'
+            wait_for(base + '/metrics')
+            cookies, names = seed(base, args.files)
+            with multiprocessing.Pool(args.clients) as clients:
+                results = clients.starmap(client, [(base, cookies, names, args.seconds, n)
+                                                   for n in range(args.clients)])
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    latencies = sorted(latency for result, _ in results for latency in result)
+    errors = sum(errors for _, errors in results)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    return len(latencies) / args.seconds, statistics.median(latencies), p99, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default='dev,gunicorn')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--files', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    print(f"{args.clients} clients, {args.seconds:g} s, {os.cpu_count()} cpus")
+    print(f"{'mode':<10}{'requests/s':>12}{'p50 ms':>9}{'p99 ms':>9}{'errors':>9}")
+    for mode in args.modes.split(','):
+        rate, p50, p99, errors = run(mode, args)
+        print(f"{mode:<10}{rate:12.1f}{p50 * 1000:9.1f}{p99 * 1000:9.1f}{errors:9}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Write throughput of the files table against the number of shards.
+
+Run from the backend directory:
+
+    python -m bench.shards [--shards 1,2,4,8] [--writers 8] [--seconds 5]
+
+For every shard count a fresh data directory is made in a temp directory
+and ``--writers`` processes, like the server's worker processes, insert
+files for random users as fast as they can. Each file is one transaction
+through insert_files() and restore_blobs(), the path create_file() takes
+after its checks, with bodies from bench.seed around ``--median-size``
+bytes. All writers start
+together and count for ``--seconds``; files/s, the speedup over the first
+shard count and commit latency percentiles are printed. "locked" counts
+inserts that gave up after DB_BUSY_TIMEOUT waiting for a shard's lock.
+
+On a 1 CPU container with 8 writers and 10 s per count, 1 shard did about
+620 files/s, 4 shards 680 (1.1x) and 8 shards 745 (1.2x), while p99 went
+from 180-230 ms to 60-70 ms: with one database most of the tail is writers
+backing off on the busy lock. The inserts themselves (JSON, the trigram
+index) are CPU-bound, so throughput keeps scaling with shards only while
+there are cores for the writers to run on.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, '.')
+
+os.environ.setdefault('ADMIN_PASSWORD', 'bench')
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from flask import Flask  # noqa: E402
+
+from bench.seed import document, file_size  # noqa: E402
+from blueprints import blobs, database  # noqa: E402
+from blueprints.files import insert_files, restore_blobs  # noqa: E402
+
+
+def writer(seed, args, start, stop, results):
+    rng = random.Random(seed)
+    contents = [document(rng, file_size(rng, args.median_size)) for _ in range(200)]
+    app = Flask(__name__)
+    database.init_app(app)
+    latencies = []
+    locked = 0
+    start.wait()
+    while time.time() < stop.value:
+        user_id = rng.randint(2, args.users + 1)
+        began = time.perf_counter()
+        content = rng.choice(contents)
+        try:
+            with app.app_context():
+                with database.get_files_connection(user_id) as conn:
+                    insert_files(conn.cursor(), [(user_id, uuid.uuid4().hex, content, time.time())])
+                restore_blobs([content])
+        except sqlite3.OperationalError:
+            locked += 1
+            continue
+        latencies.append(time.perf_counter() - began)
+    results.put((latencies, locked))
+
+
+def run(shards, args):
+    ctx = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, 'app.db')
+        database.DB_SHARDS = shards
+        blobs.STORAGE_DIR = os.path.join(tmp, 'json_files')
+        database.init_db()
+
+        start = ctx.Event()
+        stop = ctx.Value('d', 0.0)
+        results = ctx.Queue()
+        processes = [ctx.Process(target=writer, args=(args.seed + n, args, start, stop, results))
+                     for n in range(args.writers)]
+        for process in processes:
+            process.start()
+        # Give every writer time to build its documents before the clock starts
+        time.sleep(1 + args.writers * 0.1)
+        stop.value = time.time() + args.seconds
+        start.set()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    latencies = sorted(latency for outcome in outcomes for latency in outcome[0])
+    locked = sum(outcome[1] for outcome in outcomes)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    return {
+        'files': len(latencies),
+        'throughput': len(latencies) / args.seconds,
+        'p50_ms': percentile(0.50),
+        'p99_ms': percentile(0.99),
+        'locked': locked,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shards', default='1,2,4,8', help='shard counts to compare')
+    parser.add_argument('--writers', type=int, default=8, help='writer processes')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--users', type=int, default=1000, help='users the files are spread over')
+    parser.add_argument('--median-size', type=int, default=1024, help='median file size in bytes')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    print(f"{args.writers} writers, {args.seconds:g} s per shard count, {os.cpu_count()} CPUs")
+    print(f"{'shards':>6}{'files/s':>10}{'speedup':>9}{'p50 ms':>9}{'p99 ms':>9}{'locked':>8}")
+    first = None
+    for shards in [int(count) for count in args.shards.split(',')]:
+        result = run(shards, args)
+        first = first or result['throughput']
+        print(f"{shards:>6}{result['throughput']:10.1f}{result['throughput'] / first:8.2f}x"
+              f"{result['p50_ms']:9.2f}{result['p99_ms']:9.2f}{result['locked']:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
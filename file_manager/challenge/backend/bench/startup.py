@@ -0,0 +1,82 @@
+"""Time from starting the backend to its first 200 response.
+
+Run from the backend directory:
+
+    python -m bench.startup [--repeat 5] [--max-ms 0]
+
+Boots the app in a fresh interpreter on a copy of the backend (the tracked
+data/ directory is left alone) and times, until a request through the test
+client comes back 200:
+
+    import    from the first line of ``import app``
+    process   from spawning the interpreter, interpreter start-up included
+
+``first boot`` starts from an empty data directory and includes creating
+the schema and hashing the admin password. ``restart`` boots again on the
+data the first boot left behind, which is what every restart and every
+scaled-out replica pays. Medians of ``--repeat`` runs are printed; with
+``--max-ms`` the exit status is non-zero when the restart's import time is
+above it, so the number can be tracked in CI.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import time
+start = time.perf_counter()
+from app import app
+status = app.test_client().get('/metrics').status_code
+print(status, time.perf_counter() - start, time.time())
+"""
+
+
+def boot(root):
+    env = dict(os.environ, ADMIN_PASSWORD='bench', FLAG='bench', LOG_LEVEL='WARNING',
+               PYTHONDONTWRITEBYTECODE='1')
+    spawned = time.time()
+    result = subprocess.run([sys.executable, '-c', CHILD], cwd=root, env=env,
+                            capture_output=True, text=True, check=True)
+    status, import_seconds, ready = result.stdout.split()[-3:]
+    if status != '200':
+        raise RuntimeError(f'first response was {status}')
+    return float(import_seconds), float(ready) - spawned
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=0, help='restart import budget, 0 to only report')
+    args = parser.parse_args(argv)
+
+    runs = {'first boot': [], 'restart': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, 'backend')
+        shutil.copytree(BACKEND, root, ignore=shutil.ignore_patterns('data', '__pycache__', '.env'))
+        for _ in range(args.repeat):
+            shutil.rmtree(os.path.join(root, 'data'), ignore_errors=True)
+            runs['first boot'].append(boot(root))
+            runs['restart'].append(boot(root))
+
+    print(f"{'':<12}{'import ms':>12}{'process ms':>12}")
+    for name, timings in runs.items():
+        imported = statistics.median(timing[0] for timing in timings) * 1000
+        process = statistics.median(timing[1] for timing in timings) * 1000
+        print(f"{name:<12}{imported:12.1f}{process:12.1f}")
+
+    restart = statistics.median(timing[0] for timing in runs['restart']) * 1000
+    if args.max_ms and restart > args.max_ms:
+        print(f"restart took {restart:.1f} ms, budget {args.max_ms:g} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""WAF scan throughput over benign and hostile payloads of increasing size.
+
+Run from the backend directory:
+
+    python -m bench.waf [--sizes 1024,65536,1048576] [--repeat 5]
+
+For every payload the best of ``--repeat`` runs is reported in MB/s, next to
+the original per-call regex so regressions in either direction show up.
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from urllib.parse import unquote_plus
+
+sys.path.insert(0, '.')
+
+from blueprints.waf import WafEngine  # noqa: E402
+
+DEFAULT_SIZES = [1024, 16 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+
+
+def legacy_waf(input):
+    """The WAF as it was before the engine, kept for comparison."""
+    input = unquote_plus(input)
+    input = input.lower()
+    pattern = re.compile(
+        r'(?:\b[a-zA-Z_]\w*[\s\/\\]*\()|'
+        r'(?:<\s*[a-zA-Z]+(?:\s|>))|'
+        r'(?:<[^>]*\s[^>]*>)',
+        re.I
+    )
+    return pattern.search(input)
+
+
+def _repeat_to(chunk, size):
+    return (chunk * (size // len(chunk) + 1))[:size]
+
+
+def benign_json(size):
+    record = {'name': 'report', 'tags': ['alpha', 'beta'], 'count': 42, 'ok': True, 'note': 'plain text only'}
+    items = []
+    length = 2
+    while length < size:
+        item = json.dumps(record)
+        items.append(item)
+        length += len(item) + 2
+    return '[' + ', '.join(items) + ']'
+
+
+# name -> (builder, expected to be rejected)
+CORPUS = {
+    'benign_json': (benign_json, False),
+    'benign_prose': (lambda size: _repeat_to('the quick brown fox jumps over the lazy dog. ', size), False),
+    'benign_urlencoded': (lambda size: _repeat_to('key=value+with+spaces&pct=100%25&', size), False),
+    'hostile_tail': (lambda size: benign_json(size) + "<img src=x onerror=alert(1)>", True),
+    'hostile_unclosed_tags': (lambda size: _repeat_to('<', size), False),
+    'hostile_open_brackets': (lambda size: _repeat_to('< a', size), False),
+    'hostile_parens': (lambda size: _repeat_to('1 / (', size), False),
+    'hostile_whitespace_runs': (lambda size: _repeat_to('a' + ' ' * 63, size), False),
+}
+
+
+def measure(func, payload, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(payload)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--legacy-max', type=int, default=4096,
+                        help='skip the legacy regex above this size (it is quadratic on some payloads)')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    engine = WafEngine(max_scan_bytes=max(sizes) * 2)
+
+    print(f"{'payload':<26}{'bytes':>10}{'engine MB/s':>14}{'legacy MB/s':>14}  blocked")
+    for name, (build, expected) in CORPUS.items():
+        for size in sizes:
+            payload = build(size)
+            blocked = engine.scan(payload) is not None
+            if blocked != expected:
+                print(f"unexpected result for {name} at {size} bytes: blocked={blocked}", file=sys.stderr)
+                return 1
+            mb = len(payload) / 1e6
+            engine_rate = mb / measure(engine.scan, payload, args.repeat)
+            if len(payload) <= args.legacy_max:
+                legacy_rate = f"{mb / measure(legacy_waf, payload, args.repeat):14.1f}"
+            else:
+                legacy_rate = f"{'-':>14}"
+            print(f"{name:<26}{len(payload):>10}{engine_rate:14.1f}{legacy_rate}  {blocked}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,26 +1,71 @@
 from flask import Blueprint, request, jsonify, session
+import heapq
+import itertools
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
-from .database import get_db_connection
+from .database import fan_out
 
 admin_bp = Blueprint('admin', __name__)
 
+MAX_SEARCH_LIMIT = 100
+
+
+def search_shard(conn, query, limit, ranked):
+    """(sort key, filename) of the first limit matches in one shard, in order.
+
+    Ranked searches order by bm25 relevance, otherwise results come back in
+    insertion order. Queries shorter than a trigram or containing LIKE
+    wildcards can't be expressed as a phrase match and always use LIKE.
+    """
+    cursor = conn.cursor()
+    if ranked and len(query) >= 3 and '%' not in query and '_' not in query:
+        phrase = '"' + query.replace('"', '""') + '"'
+        cursor.execute("""
+            SELECT files_fts.rank AS key, files.filename FROM files_fts
+            JOIN files ON files.id = files_fts.rowid
+            WHERE files_fts MATCH ?
+            ORDER BY files_fts.rank
+            LIMIT ?
+        """, (phrase, limit))
+    else:
+        cursor.execute("""
+            SELECT COALESCE(files.created_at, 0) AS key, files.filename FROM files_fts
+            JOIN files ON files.id = files_fts.rowid
+            WHERE files_fts.content LIKE ?
+            ORDER BY files_fts.rowid
+            LIMIT ?
+        """, (f'%{query}%', limit))
+    return [(row['key'], row['filename']) for row in cursor.fetchall()]
+
+
+def search_files(query, limit=1, offset=0, ranked=False):
+    """Return filenames whose content contains query, using the trigram index.
+
+    Every shard is searched at once for its first offset + limit matches and
+    the lists are merged, by relevance or by creation time. bm25 scores come
+    from each shard's own statistics, so ranking across shards is close to
+    but not exactly what one database would give.
+    """
+    shards = fan_out(lambda conn: search_shard(conn, query, offset + limit, ranked))
+    merged = heapq.merge(*shards, key=lambda match: match[0])
+    return [filename for _, filename in itertools.islice(merged, offset, offset + limit)]
+
 
 @admin_bp.route('/admin_debug', methods=['POST'])
 def get_all_files():
     query_param = request.args.get('query')
+    limit = max(1, min(request.args.get('limit', 1, type=int), MAX_SEARCH_LIMIT))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    ranked = request.args.get('order') == 'rank'
     if 'user_id' not in session:
         return jsonify({'message': 'Unauthorized'}), 401
     
     # if not session.get('admin'):
     #     return jsonify({'message': 'Only Admin can do this'}), 403
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT filename FROM files WHERE content LIKE ?", (f'%{query_param}%',))
-        file = cursor.fetchone()
+    files = search_files(str(query_param), limit, offset, ranked)
 
-    if file is None:
+    if not files:
         return jsonify({'message': 'File not found'}), 404
 
-    return jsonify({'filename': file['filename'], 'message': query_param})
+    return jsonify({'filename': files[0], 'files': files, 'message': query_param})
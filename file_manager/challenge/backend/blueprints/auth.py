@@ -1,10 +1,14 @@
 from flask import Blueprint, request, jsonify, session
 import sqlite3
-from werkzeug.security import generate_password_hash, check_password_hash
 from .database import get_db_connection
+from .passwords import hasher, HasherBusy
 
 auth_bp = Blueprint('auth', __name__)
 
+@auth_bp.errorhandler(HasherBusy)
+def hasher_busy(e):
+    return jsonify({'message': 'Server busy, please try again'}), 503, {'Retry-After': '1'}
+
 @auth_bp.route('/register', methods=['POST', 'OPTIONS'])
 def register():
     if request.method == 'OPTIONS':
@@ -17,7 +21,7 @@ def register():
         return jsonify({'message': 'Username and password required'}), 400
 
     # Hash the password before storing
-    hashed_password = generate_password_hash(password)
+    hashed_password = hasher.hash(password)
 
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -27,10 +31,8 @@ def register():
                        (username, hashed_password, 0))
         conn.commit()
     except sqlite3.IntegrityError:
-        conn.close()
+        conn.rollback()
         return jsonify({'message': 'User already exists'}), 400
-    finally:
-        conn.close()
 
     return jsonify({'message': 'User registered successfully'}), 201
 
@@ -42,23 +44,22 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
         user = cursor.fetchone()
 
-        if user and check_password_hash(user['password'], password):
-            session['user_id'] = user['id']
-            session['username'] = username
-            session['admin'] = user['admin']
-            return jsonify({'message': 'Login successful'}), 200
-        
-        return jsonify({'message': 'Invalid credentials'}), 401
+    if user and hasher.check(user['password'], password):
+        if hasher.needs_rehash(user['password']):
+            # Hashing parameters changed since this hash was made
+            with get_db_connection() as conn:
+                conn.execute("UPDATE users SET password = ? WHERE id = ?", (hasher.hash(password), user['id']))
+        session['user_id'] = user['id']
+        session['username'] = username
+        session['admin'] = user['admin']
+        return jsonify({'message': 'Login successful'}), 200
     
-    finally:
-        conn.close()
+    return jsonify({'message': 'Invalid credentials'}), 401
 
 @auth_bp.route('/logout', methods=['POST', 'OPTIONS'])
 def logout():
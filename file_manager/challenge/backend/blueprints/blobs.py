@@ -0,0 +1,142 @@
+import glob
+import hashlib
+import os
+import tempfile
+
+# Document bodies live here, named by the sha256 of their bytes
+STORAGE_DIR = 'data/json_files'
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_path(digest):
+    # Fan out into 256 subdirectories to keep directory listings small
+    return os.path.join(STORAGE_DIR, digest[:2], digest)
+
+
+def put(content):
+    """Store content (str) once and return (hash, size in bytes).
+
+    Identical content maps to the same file, so it is only written when no
+    blob with that hash exists yet. Writes go through a temp file and a
+    rename, readers never see a partial blob.
+    """
+    data = content.encode('utf-8')
+    digest = content_hash(data)
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return digest, len(data)
+
+
+class BlobWriter:
+    """Writes a blob whose content arrives in pieces.
+
+    The bytes go to a temp file and are hashed on the way, commit() then
+    links the file to its content address. The temp file stays until
+    restore(), so a blob released before the caller's rows committed can be
+    put back without holding the content in memory.
+    """
+
+    def __init__(self):
+        os.makedirs(STORAGE_DIR, exist_ok=True)
+        fd, self.tmp = tempfile.mkstemp(dir=STORAGE_DIR, prefix='.tmp-')
+        self.file = os.fdopen(fd, 'wb')
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def commit(self):
+        """Return (hash, size in bytes) of the stored blob."""
+        self.file.close()
+        digest = self.hash.hexdigest()
+        self.path = blob_path(digest)
+        self._link()
+        return digest, self.size
+
+    def restore(self):
+        """Call once the rows referencing the blob are committed."""
+        self._link()
+        os.unlink(self.tmp)
+
+    def _link(self):
+        if not os.path.exists(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            try:
+                os.link(self.tmp, self.path)
+            except FileExistsError:
+                pass
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.unlink(self.tmp)
+        except FileNotFoundError:
+            pass
+
+
+def read_bytes(digest):
+    with open(blob_path(digest), 'rb') as f:
+        return f.read()
+
+
+def read_text(digest):
+    with open(blob_path(digest), encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+def read_prefix(digest, size):
+    """The text of at most the first size bytes of a blob."""
+    with open(blob_path(digest), 'rb') as f:
+        # A character cut in half at the end is dropped
+        return f.read(size).decode('utf-8', 'ignore')
+
+
+def variant_path(digest, name):
+    """Where a file derived from a blob (e.g. a compressed copy) is kept."""
+    return f'{blob_path(digest)}.{name}'
+
+
+def discard_variants(digest, name=None):
+    """Delete the derived files of a blob, or only those under name."""
+    pattern = glob.escape(variant_path(digest, name) if name else blob_path(digest)) + '.*'
+    for path in glob.glob(pattern):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def release(conns, digests):
+    """Delete the blobs in digests that no file row references any more.
+
+    conns is a connection to every shard, blobs are shared by all of them.
+    """
+    cursors = [conn.cursor() for conn in conns]
+    for digest in set(digests):
+        referenced = False
+        for cursor in cursors:
+            cursor.execute("SELECT 1 FROM files WHERE content_hash = ? LIMIT 1", (digest,))
+            if cursor.fetchone() is not None:
+                referenced = True
+                break
+        if not referenced:
+            try:
+                os.unlink(blob_path(digest))
+            except FileNotFoundError:
+                pass
+            discard_variants(digest)
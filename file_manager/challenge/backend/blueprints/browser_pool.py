@@ -0,0 +1,128 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+# Browser pool settings
+BROWSER_POOL_SIZE = int(os.environ.get('BROWSER_POOL_SIZE', 2))
+BROWSER_MAX_VISITS = int(os.environ.get('BROWSER_MAX_VISITS', 50))
+BROWSER_VISIT_TIMEOUT = float(os.environ.get('BROWSER_VISIT_TIMEOUT', 60))
+
+
+class BrowserWorker(threading.Thread):
+    """Owns one headless Chromium and runs visits against it.
+
+    Playwright's sync API is bound to the thread that started it, so every
+    browser lives on its own thread and jobs are handed over via a queue.
+    """
+
+    def __init__(self, jobs, max_visits):
+        super().__init__(daemon=True)
+        self.jobs = jobs
+        self.max_visits = max_visits
+        self.playwright = None
+        self.browser = None
+        self.visits = 0
+        self.launches = 0
+
+    def launch(self):
+        if self.playwright is None:
+            from playwright.sync_api import sync_playwright
+            self.playwright = sync_playwright().start()
+        self.browser = self.playwright.chromium.launch(headless=True)
+        self.visits = 0
+        self.launches += 1
+
+    def recycle(self):
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except Exception:
+                pass
+        self.browser = None
+
+    def shutdown(self):
+        self.recycle()
+        if self.playwright is not None:
+            self.playwright.stop()
+            self.playwright = None
+
+    def run(self):
+        # Warm the browser up front so the first report doesn't pay for it
+        try:
+            self.launch()
+        except Exception:
+            log.warning('Browser launch failed, retrying on first visit', exc_info=True)
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            func, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if self.browser is None or not self.browser.is_connected():
+                    self.recycle()
+                    self.launch()
+                # Every visit gets its own isolated context
+                context = self.browser.new_context()
+                try:
+                    future.set_result(func(context))
+                finally:
+                    context.close()
+            except Exception as e:
+                future.set_exception(e)
+                if self.browser is not None and not self.browser.is_connected():
+                    self.recycle()
+            else:
+                self.visits += 1
+                if self.visits >= self.max_visits:
+                    self.recycle()
+
+        self.shutdown()
+
+
+class BrowserPool:
+    """Fixed set of long-lived browsers that hand out fresh contexts."""
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_visits=BROWSER_MAX_VISITS):
+        self.size = size
+        self.max_visits = max_visits
+        self.jobs = queue.Queue()
+        self.workers = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.workers:
+                return
+            for _ in range(self.size):
+                worker = BrowserWorker(self.jobs, self.max_visits)
+                worker.start()
+                self.workers.append(worker)
+
+    def stop(self):
+        with self._lock:
+            for _ in self.workers:
+                self.jobs.put(None)
+            for worker in self.workers:
+                worker.join(timeout=10)
+            self.workers = []
+
+    def submit(self, func):
+        """Queue func(context) to run on the next free browser."""
+        self.start()
+        future = Future()
+        self.jobs.put((func, future))
+        return future
+
+    def visit(self, func, timeout=BROWSER_VISIT_TIMEOUT):
+        """Run func(context) on a pooled browser and wait for its result."""
+        return self.submit(func).result(timeout=timeout)
+
+
+pool = BrowserPool()
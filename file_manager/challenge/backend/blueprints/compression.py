@@ -0,0 +1,44 @@
+import gzip
+import os
+import tempfile
+import zlib
+
+from flask import request
+
+# Bodies smaller than this go out as they are
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+
+# Content-Encoding -> (file suffix, compress function), in order of preference
+ENCODINGS = {
+    'gzip': ('gz', lambda data: gzip.compress(data, COMPRESS_LEVEL, mtime=0)),
+    'deflate': ('zz', lambda data: zlib.compress(data, COMPRESS_LEVEL)),
+}
+
+
+def negotiate(size):
+    """The Content-Encoding for a body of about size bytes, or None to send it as is."""
+    if size is None or size < COMPRESS_MIN_BYTES:
+        return None
+    return request.accept_encodings.best_match(list(ENCODINGS))
+
+
+def cached(path, encoding, body):
+    """Path of the encoded copy of path, compressing body() on first use.
+
+    Variants live next to their blob and are named after it, a blob never
+    changes so neither does its compressed copy.
+    """
+    suffix, compress = ENCODINGS[encoding]
+    target = f'{path}.{suffix}'
+    if not os.path.exists(target):
+        data = compress(body())
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return target
@@ -1,11 +1,245 @@
 import sqlite3
+import concurrent.futures
+import contextlib
+import contextvars
+import hashlib
+import hmac
+import logging
+import queue
+import tempfile
+import threading
+import time
+import zlib
+from flask import g, has_app_context
 from werkzeug.security import generate_password_hash
+from .passwords import PASSWORD_HASH_METHOD
+from . import blobs
 DB_NAME = "data/app.db"
 import os
 
-from dotenv import load_dotenv
+log = logging.getLogger(__name__)
+
+# Connection pool settings
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_BUSY_TIMEOUT = int(os.environ.get('DB_BUSY_TIMEOUT', 5000))
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', 128))
+# Number of databases the files table is split across, see shard_for()
+DB_SHARDS = int(os.environ.get('DB_SHARDS', 1))
+
+
+# Seconds spent in sqlite by the current request, see start_db_timer()
+_db_timer = contextvars.ContextVar('db_timer', default=None)
+
+
+def start_db_timer():
+    _db_timer.set([0.0])
+
+
+def stop_db_timer():
+    """Return the time summed since start_db_timer() and stop counting."""
+    total = _db_timer.get()
+    _db_timer.set(None)
+    return total[0] if total else 0.0
+
+
+def _add_db_time(seconds):
+    total = _db_timer.get()
+    if total is not None:
+        total[0] += seconds
+
+
+def _timed(method):
+    def wrapper(self, *args):
+        start = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            _add_db_time(time.perf_counter() - start)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that adds the time spent in sqlite to the request's db_time."""
+
+    execute = _timed(sqlite3.Cursor.execute)
+    executemany = _timed(sqlite3.Cursor.executemany)
+    executescript = _timed(sqlite3.Cursor.executescript)
+    fetchone = _timed(sqlite3.Cursor.fetchone)
+    fetchmany = _timed(sqlite3.Cursor.fetchmany)
+    fetchall = _timed(sqlite3.Cursor.fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose statements and commits count towards db_time."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    commit = _timed(sqlite3.Connection.commit)
+    rollback = _timed(sqlite3.Connection.rollback)
+    __exit__ = _timed(sqlite3.Connection.__exit__)
+
+
+def shard_path(shard):
+    """Database file of a shard. Shard 0 is DB_NAME, the catalog, itself."""
+    if shard == 0:
+        return DB_NAME
+    root, ext = os.path.splitext(DB_NAME)
+    return f'{root}-shard{shard}{ext}'
+
+
+def shard_for(user_id):
+    """The shard holding user_id's files.
+
+    Every row of a user lives on one shard, so their listing, export and
+    writes only ever touch that database, and writes of users on different
+    shards don't wait for each other's lock.
+    """
+    if DB_SHARDS == 1:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % DB_SHARDS
+
+
+def _connect(shard=0):
+    """Open a connection and apply the per-connection pragmas once."""
+    conn = sqlite3.connect(shard_path(shard), check_same_thread=False, factory=TimedConnection,
+                           cached_statements=DB_STATEMENT_CACHE)
+    conn.row_factory = sqlite3.Row  # Allows dictionary-like row access
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived sqlite connections."""
+
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, shard=0):
+        self.size = size
+        self.timeout = timeout
+        self.shard = shard
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def acquire(self):
+        """Check out a connection, opening a new one while under the size limit."""
+        start = time.perf_counter()
+        waited = False
+        with self._lock:
+            if self._idle.empty() and self._opened < self.size:
+                self._opened += 1
+                opening = True
+            else:
+                opening = False
+        if opening:
+            try:
+                conn = _connect(self.shard)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        else:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                # Every connection is checked out, block until one comes back
+                waited = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError('database connection pool exhausted')
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += elapsed
+                self._max_wait_time = max(self._max_wait_time, elapsed)
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any open transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def stats(self):
+        """Return pool-size, wait-time and checkout counters."""
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._opened,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': self._wait_time,
+                'wait_time_max': self._max_wait_time,
+            }
+
+
+# Pool of the catalog, which is also shard 0
+pool = ConnectionPool()
+# Pools of shards 1 and up, opened on first use
+_shard_pools = {}
+_shard_pools_lock = threading.Lock()
+# Runs the per-shard queries of fan_out()
+_fan_out_executor = None
+# Pools inherited across a fork, see _reset_pool()
+_inherited = []
+
+
+def shard_pool(shard):
+    if shard == 0:
+        return pool
+    with _shard_pools_lock:
+        if shard not in _shard_pools:
+            _shard_pools[shard] = ConnectionPool(pool.size, pool.timeout, shard)
+        return _shard_pools[shard]
+
+
+def pool_stats():
+    """stats() of the pools this process has opened, by shard."""
+    with _shard_pools_lock:
+        pools = dict(_shard_pools)
+    pools[0] = pool
+    return {shard: pools[shard].stats() for shard in sorted(pools)}
+
+
+def _reset_pool():
+    global pool, _shard_pools, _shard_pools_lock, _fan_out_executor
+    # A forked process must not use its parent's sqlite connections, nor close
+    # them: closing the last handle could checkpoint and remove the WAL the
+    # parent is still using. Keep them referenced and start empty pools.
+    _inherited.append(pool)
+    _inherited.extend(_shard_pools.values())
+    pool = ConnectionPool(pool.size, pool.timeout)
+    _shard_pools = {}
+    _shard_pools_lock = threading.Lock()
+    # Its threads stayed behind in the parent
+    _fan_out_executor = None
+
+
+os.register_at_fork(after_in_child=_reset_pool)
 
-load_dotenv()
 
 def init_db():
     """Initialize the database and create tables if they don't exist."""
@@ -19,30 +253,387 @@ def init_db():
                 admin INTEGER NOT NULL DEFAULT 0
             )
         """)
-        print(os.environ['ADMIN_PASSWORD'])
-        hashed_password = generate_password_hash(os.environ['ADMIN_PASSWORD'])
+
+        _create_files_table(cursor)
 
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS files (
+            CREATE TABLE IF NOT EXISTS report_jobs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
-                filename TEXT NOT NULL,
-                content TEXT NOT NULL,
-                visits INTEGER NOT NULL DEFAULT 0,
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+                url TEXT NOT NULL,
+                cookie_domain TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                error TEXT,
+                queued_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
             )
         """)
-
-        # Check if admin user exists before inserting
-        cursor.execute("DELETE FROM users WHERE username = 'admin'")
-        cursor.execute("""
-            INSERT INTO users (username, password, admin) VALUES (?, ?, ?)
-        """, ('admin', hashed_password, 1))
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_report_jobs_status ON report_jobs (status, id)")
 
         conn.commit()
 
+        migrate(conn)
+        seed_admin(conn)
+        check_shard_count(conn)
+
+    # Shard 0 is the catalog database above
+    for shard in range(1, DB_SHARDS):
+        with sqlite3.connect(shard_path(shard)) as conn:
+            _create_files_table(conn.cursor())
+            conn.commit()
+            migrate(conn)
+
+
+def _create_files_table(cursor):
+    # Later columns and indexes are added by MIGRATIONS
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            content TEXT NOT NULL,
+            visits INTEGER NOT NULL DEFAULT 0,
+            created_at REAL,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+
+
+def check_shard_count(conn):
+    """Remember DB_SHARDS, refusing to change it once files were stored.
+
+    Files are routed by shard_for(), so a different shard count would look
+    for them in the wrong database. Databases from before sharding count as
+    one shard.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM settings WHERE key = 'db_shards'")
+    row = cursor.fetchone()
+    if row is not None and int(row[0]) == DB_SHARDS:
+        return
+    previous = int(row[0]) if row is not None else 1
+    if previous != DB_SHARDS:
+        for shard in range(previous):
+            if shard == 0:
+                stored = conn.execute("SELECT 1 FROM files LIMIT 1").fetchone()
+            elif os.path.exists(shard_path(shard)):
+                with contextlib.closing(sqlite3.connect(shard_path(shard))) as shard_conn:
+                    stored = shard_conn.execute("SELECT 1 FROM files LIMIT 1").fetchone()
+            else:
+                stored = None
+            if stored is not None:
+                raise RuntimeError(f'Files are stored in {previous} shards, DB_SHARDS={DB_SHARDS} '
+                                   'would lose track of them')
+    cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('db_shards', ?)", (str(DB_SHARDS),))
+    conn.commit()
+
+
+def _seed_key():
+    """Secret the admin fingerprint is keyed with, never stored in the database.
+
+    ADMIN_SEED_KEY if set, otherwise random bytes kept in ADMIN_SEED_KEY_FILE
+    (admin_seed.key next to the database), created on first use. Returns
+    None if neither is usable.
+    """
+    key = os.environ.get('ADMIN_SEED_KEY')
+    if key:
+        return key.encode()
+    path = os.environ.get('ADMIN_SEED_KEY_FILE') or os.path.join(os.path.dirname(DB_NAME), 'admin_seed.key')
+    try:
+        with open(path, 'rb') as f:
+            key = f.read()
+    except FileNotFoundError:
+        key = os.urandom(32)
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(key)
+            # A link never replaces the key another process just created
+            os.link(tmp, path)
+        except FileExistsError:
+            with open(path, 'rb') as f:
+                key = f.read()
+        except OSError:
+            log.warning('Cannot create the admin seed key, the admin password is rehashed on every start')
+            return None
+        finally:
+            if tmp is not None:
+                os.unlink(tmp)
+    return key if len(key) >= 16 else None
+
+
+def _admin_fingerprint(key, pwhash, password):
+    # Includes the salted hash it vouches for, so it changes on every rehash
+    message = f'{PASSWORD_HASH_METHOD}\0{pwhash}\0{password}'.encode()
+    return hmac.new(key, message, hashlib.sha256).hexdigest()
+
+
+def seed_admin(conn):
+    """Create the admin user, or update it when ADMIN_PASSWORD changed.
+
+    A fingerprint of the password and hash method as of the last seed is
+    kept in settings, so a restart with the same environment skips the slow
+    hash and the row (and its id) stays as it is. It is an HMAC keyed with
+    _seed_key(), so a copy of the database alone is no faster to brute-force
+    than the scrypt hash next to it.
+    """
+    password = os.environ['ADMIN_PASSWORD']
+    key = _seed_key()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT users.password, settings.value FROM users
+        LEFT JOIN settings ON settings.key = 'admin_fingerprint'
+        WHERE users.username = 'admin' AND users.admin = 1
+    """)
+    row = cursor.fetchone()
+    if (key is not None and row is not None and row[1] is not None
+            and hmac.compare_digest(row[1], _admin_fingerprint(key, row[0], password))):
+        return False
+
+    hashed_password = generate_password_hash(password, PASSWORD_HASH_METHOD)
+    cursor.execute("""
+        INSERT INTO users (username, password, admin) VALUES ('admin', ?, 1)
+        ON CONFLICT (username) DO UPDATE SET password = excluded.password, admin = 1
+    """, (hashed_password,))
+    if key is None:
+        cursor.execute("DELETE FROM settings WHERE key = 'admin_fingerprint'")
+    else:
+        cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('admin_fingerprint', ?)",
+                       (_admin_fingerprint(key, hashed_password, password),))
+    conn.commit()
+    return True
+
+
+def _add_filename_index(cursor):
+    """Unique index for the by-filename lookups (admin detail/content)."""
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_files_filename ON files (filename)")
+
+
+def _add_filename_user_index(cursor):
+    """Composite index for the owner-scoped filename lookups."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_files_filename_user ON files (filename, user_id)")
+
+
+def _add_files_created_at(cursor):
+    """created_at column and the (user_id, id) index behind the paged listing."""
+    cursor.execute("PRAGMA table_info(files)")
+    if 'created_at' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE files ADD COLUMN created_at REAL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_files_user_id ON files (user_id, id)")
+
+
+def _add_files_fts(cursor):
+    """Trigram full-text index over files.content, kept in sync by triggers."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'files_fts'")
+    fts_exists = cursor.fetchone() is not None
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+            content, content='files', content_rowid='id', tokenize='trigram'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS files_fts_ai AFTER INSERT ON files BEGIN
+            INSERT INTO files_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS files_fts_ad AFTER DELETE ON files BEGIN
+            INSERT INTO files_fts (files_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS files_fts_au AFTER UPDATE OF content ON files BEGIN
+            INSERT INTO files_fts (files_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO files_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    if not fts_exists:
+        # Backfill rows written before the index existed
+        cursor.execute("INSERT INTO files_fts (files_fts) VALUES ('rebuild')")
+
+
+def _move_content_to_blobs(cursor):
+    """Move document bodies out of files.content into the blob store.
+
+    files keeps content_hash and size. files_fts can no longer read content
+    from files, so it becomes a standalone index that the write paths fill
+    in themselves, deletes are still handled by a trigger.
+    """
+    cursor.execute("PRAGMA table_info(files)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'content_hash' not in columns:
+        cursor.execute("ALTER TABLE files ADD COLUMN content_hash TEXT")
+        cursor.execute("ALTER TABLE files ADD COLUMN size INTEGER")
+
+    if 'content' in columns:
+        last_id = 0
+        while True:
+            cursor.execute("SELECT id, content FROM files WHERE id > ? ORDER BY id LIMIT 500", (last_id,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for file_id, content in rows:
+                digest, size = blobs.put(content)
+                cursor.execute("UPDATE files SET content_hash = ?, size = ? WHERE id = ?", (digest, size, file_id))
+            last_id = rows[-1][0]
+
+        cursor.execute("DROP TRIGGER IF EXISTS files_fts_ai")
+        cursor.execute("DROP TRIGGER IF EXISTS files_fts_ad")
+        cursor.execute("DROP TRIGGER IF EXISTS files_fts_au")
+        cursor.execute("CREATE VIRTUAL TABLE files_fts_new USING fts5(content, tokenize='trigram')")
+        cursor.execute("INSERT INTO files_fts_new (rowid, content) SELECT id, content FROM files")
+        cursor.execute("DROP TABLE files_fts")
+        cursor.execute("ALTER TABLE files_fts_new RENAME TO files_fts")
+        cursor.execute("ALTER TABLE files DROP COLUMN content")
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS files_fts_ad AFTER DELETE ON files BEGIN
+            DELETE FROM files_fts WHERE rowid = old.id;
+        END
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files (content_hash)")
+
+
+def _add_settings(cursor):
+    """Key/value table for bookkeeping such as the admin seed fingerprint."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+
+
+# Ordered schema migrations, a step's version is its position in the list.
+# Only ever append to this list.
+MIGRATIONS = [
+    _add_filename_index,
+    _add_filename_user_index,
+    _add_files_created_at,
+    _add_files_fts,
+    _move_content_to_blobs,
+    _add_settings,
+]
+
+
+def schema_version(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return cursor.fetchone()[0] or 0
+
+
+def migrate(conn):
+    """Apply every migration newer than the database's schema_version.
+
+    Each step runs in its own IMMEDIATE transaction and re-checks the version
+    first, so several processes starting at once apply each step only once.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at REAL NOT NULL
+        )
+    """)
+    conn.commit()
+
+    for version, step in enumerate(MIGRATIONS, start=1):
+        if version <= schema_version(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            step(conn.cursor())
+            conn.execute("INSERT INTO schema_version (version, applied_at) VALUES (?, ?)",
+                         (version, time.time()))
+            conn.commit()
+            log.info('Applied schema migration', extra={'version': version, 'migration': step.__name__})
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def init_app(app):
+    """Return pooled connections at the end of every app context."""
+    app.teardown_appcontext(release_db_connection)
+
+
 def get_db_connection():
-    """Create and return a database connection."""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row  # Allows dictionary-like row access
-    return conn
+    """Return this app context's pooled connection, checking one out on first use.
+
+    Outside of an app context a standalone connection is returned and the
+    caller is responsible for closing it.
+    """
+    if not has_app_context():
+        return _connect()
+    if 'db_conn' not in g:
+        start = time.perf_counter()
+        g.db_conn = pool.acquire()
+        _add_db_time(time.perf_counter() - start)
+    return g.db_conn
+
+
+def get_shard_connection(shard):
+    """Like get_db_connection(), for the database of shard."""
+    if shard == 0:
+        return get_db_connection()
+    if not has_app_context():
+        return _connect(shard)
+    conns = g.setdefault('shard_conns', {})
+    if shard not in conns:
+        start = time.perf_counter()
+        conns[shard] = shard_pool(shard).acquire()
+        _add_db_time(time.perf_counter() - start)
+    return conns[shard]
+
+
+def get_files_connection(user_id):
+    """Connection to the shard with user_id's files."""
+    return get_shard_connection(shard_for(user_id))
+
+
+def shard_connections():
+    """A connection to every shard, in shard order."""
+    return [get_shard_connection(shard) for shard in range(DB_SHARDS)]
+
+
+def fan_out(task):
+    """Run task(conn) on every shard at once and return the results in shard order.
+
+    The connections are checked out here first, each one is then used by a
+    single thread, so a fan-out never needs more connections from a pool
+    than the request it runs for. sqlite releases the GIL while it works, so
+    the shards are searched in parallel.
+    """
+    global _fan_out_executor
+    conns = shard_connections()
+    try:
+        if len(conns) == 1:
+            return [task(conns[0])]
+        with _shard_pools_lock:
+            if _fan_out_executor is None:
+                # At most every pooled connection busy at once
+                _fan_out_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=DB_SHARDS * DB_POOL_SIZE, thread_name_prefix='db-fan-out')
+            executor = _fan_out_executor
+        # Copied contexts, so the time spent counts towards the request's db_time
+        futures = [executor.submit(contextvars.copy_context().run, task, conn) for conn in conns]
+        # Even if one fails, no connection goes back while another thread has it
+        concurrent.futures.wait(futures)
+        return [future.result() for future in futures]
+    finally:
+        if not has_app_context():
+            for conn in conns:
+                conn.close()
+
+
+def release_db_connection(exception=None):
+    """Give the app context's connections back to their pools."""
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        pool.release(conn)
+    for shard, conn in g.pop('shard_conns', {}).items():
+        shard_pool(shard).release(conn)
@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+
+# Total size of the cached document bodies, per process
+FILE_CACHE_MAX_BYTES = int(os.environ.get('FILE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Bigger documents are always streamed from disk
+FILE_CACHE_MAX_ITEM_BYTES = int(os.environ.get('FILE_CACHE_MAX_ITEM_BYTES', 256 * 1024))
+
+# Rough per-entry cost of the dict and strings next to the body
+ENTRY_OVERHEAD = 512
+
+# Bumped by every invalidation in any process. Created before the server
+# forks its workers, so they all share it through the same memory.
+_generation = multiprocessing.RawValue('Q', 0)
+_generation_lock = multiprocessing.Lock()
+
+
+class FileCache:
+    """LRU cache of file rows and their bodies, keyed by filename.
+
+    An entry is a dict with filename, user_id, content_hash, size and body
+    (the blob's bytes), enough to run the owner check and answer a read
+    without touching sqlite or the disk. Bodies count against max_bytes and
+    the least recently used entries are evicted to make room.
+
+    Deletes go through invalidate(), which drops the entries here and bumps
+    a generation counter shared with the other worker processes; a process
+    that sees the counter move clears its whole cache. A row read before an
+    invalidation is never cached after it, put() checks the generation the
+    caller saw before its query.
+    """
+
+    def __init__(self, max_bytes=FILE_CACHE_MAX_BYTES, max_item_bytes=FILE_CACHE_MAX_ITEM_BYTES):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._seen = _generation.value
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        os.register_at_fork(after_in_child=self._forget)
+
+    def generation(self):
+        """Take this before reading a row that will be passed to put()."""
+        return _generation.value
+
+    def fits(self, size):
+        return size is not None and size <= self.max_item_bytes and self.max_bytes > 0
+
+    def get(self, filename):
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(filename)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(filename)
+            self.hits += 1
+            return entry
+
+    def put(self, entry, generation):
+        body = entry.get('body')
+        if body is None or not self.fits(len(body)):
+            return
+        cost = len(body) + ENTRY_OVERHEAD
+        with self._lock:
+            self._sync()
+            if generation != self._seen:
+                # Something was deleted since the row was read
+                return
+            old = self._entries.pop(entry['filename'], None)
+            if old is not None:
+                self._bytes -= len(old['body']) + ENTRY_OVERHEAD
+            self._entries[entry['filename']] = entry
+            self._bytes += cost
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted['body']) + ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def invalidate(self, filenames):
+        """Forget filenames here and make every other process drop its cache."""
+        with _generation_lock:
+            _generation.value += 1
+            current = _generation.value
+        with self._lock:
+            if self._seen == current - 1:
+                # Nobody else bumped it in between, the rest of ours is still good
+                self._seen = current
+                for filename in filenames:
+                    old = self._entries.pop(filename, None)
+                    if old is not None:
+                        self._bytes -= len(old['body']) + ENTRY_OVERHEAD
+                        self.invalidations += 1
+            else:
+                self._sync()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _sync(self):
+        current = _generation.value
+        if current != self._seen:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            self._seen = current
+
+    def _forget(self):
+        # A fork may have caught another thread halfway through an update
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+
+cache = FileCache()
@@ -1,27 +1,357 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app, send_file, stream_with_context
+import codecs
+import hashlib
 import json
-import uuid
-from blueprints.database import get_db_connection
+import logging
 import re
-from urllib.parse import unquote_plus
+import sqlite3
+import uuid
+import time
+import os
+from werkzeug.exceptions import RequestEntityTooLarge
+from blueprints.database import fan_out, get_db_connection, get_files_connection, shard_connections
+from blueprints import blobs, compression
+from blueprints.jsonstream import JsonStreamValidator
+from blueprints.waf import engine as waf_engine
+from blueprints.visits import counter as visit_counter
+from blueprints.filecache import cache as file_cache
 
 file_bp = Blueprint('files', __name__)
+log = logging.getLogger(__name__)
 
-import re
-from urllib.parse import unquote_plus
+# Limits for the batch create/delete endpoints
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 500))
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', 8 * 1024 * 1024))
+
+# Streaming uploads, see upload_file()
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 64 * 1024 * 1024))
+UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_BYTES', 64 * 1024))
+# Only the start of larger documents goes into the search index
+SEARCH_INDEX_MAX_BYTES = int(os.environ.get('SEARCH_INDEX_MAX_BYTES', 1024 * 1024))
+
+MAX_PAGE_SIZE = 1000
+# Rows per query and bytes per chunk written by the export stream
+EXPORT_BATCH_ROWS = int(os.environ.get('EXPORT_BATCH_ROWS', 500))
+EXPORT_CHUNK_BYTES = int(os.environ.get('EXPORT_CHUNK_BYTES', 64 * 1024))
+# Optional metadata for the file listing, name -> column expression
+FILE_LIST_FIELDS = {
+    'visits': 'visits',
+    'size': 'size',
+    'created': 'created_at AS created',
+}
+
+# Most paths a content request may project with fields=
+MAX_PROJECTION_FIELDS = 32
+# One step of a projected path: a key, optionally followed by array indexes
+_PATH_STEP = re.compile(r'([^.\[\]"]+)((?:\[\d+\])*)')
 
 def waf(input):
     """waf to filter for xss"""
-    input = unquote_plus(input)
-    input = input.lower()
-    pattern = re.compile(
-        r'(?:\b[a-zA-Z_]\w*[\s\/\\]*\()|' 
-        r'(?:<\s*[a-zA-Z]+(?:\s|>))|'
-        r'(?:<[^>]*\s[^>]*>)',
-        re.I
-    )
+    return waf_engine.scan(input)
+
+def canonical_json(content):
+    """Parse content and re-serialize it the way jsonify would.
+
+    Returns None if content isn't a valid JSON document.
+    """
+    if not isinstance(content, str):
+        return None
+    try:
+        document = json.loads(content)
+    except ValueError:
+        return None
+    return json.dumps(document, separators=(',', ':'), sort_keys=True)
+
+def check_content(content):
+    """Run the WAF and JSON validation over new file content.
+
+    Returns (canonical content, None) or (None, (error message, status)).
+    """
+    if not isinstance(content, str):
+        return None, ('Invalid JSON content', 400)
+    error = waf_error(waf(content))
+    if error:
+        return None, error
+
+    canonical = canonical_json(content)
+    if canonical is None:
+        return None, ('Invalid JSON content', 400)
+    # Decoding escapes can surface text the raw scan never saw
+    if canonical != content:
+        error = waf_error(waf(canonical))
+        if error:
+            return None, error
+    return canonical, None
+
+def waf_error(hit):
+    """The (error message, status) for a WafHit, None if there was none."""
+    if hit is None:
+        return None
+    if hit.rule == 'scan_budget':
+        # Too big to scan, not an attack
+        return f'Content larger than {hit.position} bytes', 413
+    return 'Attack detected!', 400
+
+def read_batch():
+    """Return the request's JSON array, or an error response tuple."""
+    # Chunked requests have no Content-Length to check up front. The body
+    # read stops quietly at the limit, one byte past it tells it was cut.
+    request.max_content_length = BATCH_MAX_BYTES + 1
+    try:
+        body = request.get_data()
+    except RequestEntityTooLarge:
+        body = None
+    if body is None or len(body) > BATCH_MAX_BYTES:
+        return None, (jsonify({'message': f'Batch larger than {BATCH_MAX_BYTES} bytes'}), 413)
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return None, (jsonify({'message': 'Expected a JSON array'}), 400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, (jsonify({'message': f'Batch larger than {BATCH_MAX_ITEMS} items'}), 413)
+    return items, None
+
+def insert_files(cursor, rows):
+    """Store (user_id, filename, content, created_at) rows.
+
+    Bodies go to the blob store, the files table only gets their hash, and the
+    search index gets its own copy of the text, see search_text(). Call
+    restore_blobs() once the rows are committed.
+    """
+    records = []
+    for user_id, filename, content, created_at in rows:
+        digest, size = blobs.put(content)
+        records.append((user_id, filename, digest, size, created_at))
+    cursor.executemany("INSERT INTO files (user_id, filename, content_hash, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                       records)
+    cursor.executemany("INSERT INTO files_fts (rowid, content) SELECT id, ? FROM files WHERE filename = ?",
+                       [(search_text(content), filename) for _, filename, content, _ in rows])
+
+def search_text(content):
+    """What the search index gets of content: its first SEARCH_INDEX_MAX_BYTES."""
+    # No UTF-8 encoding of a string is more than four bytes per character
+    if len(content) * 4 <= SEARCH_INDEX_MAX_BYTES:
+        return content
+    return content.encode('utf-8')[:SEARCH_INDEX_MAX_BYTES].decode('utf-8', 'ignore')
+
+def restore_blobs(contents):
+    """Write back blobs a concurrent delete released before our rows committed.
+
+    release() only sees committed rows, so until the commit another request
+    deleting the same content can unlink the blob. put() only writes it if
+    it's gone.
+    """
+    for content in contents:
+        blobs.put(content)
+
+def stream_upload(stream, writer):
+    """Check a raw JSON document from stream while copying it to writer.
+
+    Runs the WAF and the JSON validation chunk by chunk, so no more than one
+    chunk of the body is held in memory. The WAF scans up to UPLOAD_MAX_BYTES
+    here, where create_file() stops at WAF_MAX_SCAN_BYTES. Returns an error
+    response tuple, or None once the whole document was written.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    validator = JsonStreamValidator()
+    raw_scan = waf_engine.stream(UPLOAD_MAX_BYTES)
+    canonical_scan = waf_engine.stream(UPLOAD_MAX_BYTES)
+    received = 0
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_BYTES)
+        final = not chunk
+        received += len(chunk)
+        if received > UPLOAD_MAX_BYTES:
+            return jsonify({'message': f'Upload larger than {UPLOAD_MAX_BYTES} bytes'}), 413
+        try:
+            text = decoder.decode(chunk, final)
+            error = waf_error(raw_scan.feed(text, final) or canonical_scan.feed(validator.feed(text, final), final))
+            if error:
+                message, status = error
+                return jsonify({'message': message}), status
+        except ValueError:
+            return jsonify({'message': 'Invalid JSON content'}), 400
+        if final:
+            return None
+        writer.write(chunk)
+
+def send_encoded(path, encoding):
+    # conditional() owns the validators, werkzeug would answer Range and
+    # If-Modified-Since itself from the shared blob file's mtime
+    response = send_file(os.path.abspath(path), mimetype='application/json', etag=False, conditional=False)
+    del response.headers['Last-Modified']
+    del response.headers['Content-Disposition']
+    if encoding:
+        response.content_encoding = encoding
+    return response
+
+def json_response(file, encoding=None):
+    """The stored, already canonical JSON blob, from the cache or straight from disk."""
+    if file['body'] is not None and not encoding:
+        return current_app.response_class(file['body'], mimetype='application/json')
+    path = blobs.blob_path(file['content_hash'])
+    if encoding:
+        path = compression.cached(path, encoding, lambda: blobs.read_bytes(file['content_hash']))
+    return send_encoded(path, encoding)
+
+def details_response(file, encoding=None):
+    """The file's name and content wrapped in a JSON object."""
+    def body():
+        if file['body'] is not None:
+            content = file['body'].decode('utf-8')
+        else:
+            content = blobs.read_text(file['content_hash'])
+        return jsonify({'filename': file['filename'], 'content': content})
+    if not encoding:
+        return body()
+    # The wrapped body differs per file name, so its compressed copy does too
+    path = compression.cached(blobs.variant_path(file['content_hash'], file['filename']), encoding,
+                              lambda: body().get_data())
+    return send_encoded(path, encoding)
+
+def lookup_file(filename):
+    """The row of filename, from the session user's shard or, for admins, any shard."""
+    def on_shard(conn):
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT filename, user_id, content_hash, size FROM files WHERE filename = ?",
+                           (filename,))
+            return cursor.fetchone()
+    if session['admin']:
+        rows = fan_out(on_shard)
+    else:
+        rows = [on_shard(get_files_connection(session['user_id']))]
+    return next((row for row in rows if row is not None), None)
+
+def find_file(filename):
+    """The session's view of a file: its row and, if cached, its body.
+
+    Admins see every file, everyone else only their own. Rows come from the
+    read cache when possible, the owner check then runs on the cached
+    user_id without a query. On a miss the body is left for load_body().
+    Returns None if there is nothing to show.
+    """
+    file = file_cache.get(filename)
+    if file is None:
+        generation = file_cache.generation()
+        row = lookup_file(filename)
+        if row is None:
+            return None
+        file = dict(row)
+        file['body'] = None
+        file['generation'] = generation
+
+    if not session['admin'] and file['user_id'] != session['user_id']:
+        return None
+    return file
+
+def load_body(file):
+    """Read a small file's body into its row and cache it.
+
+    Returns False if the blob is gone, deleted and released since the row
+    was read. Bigger bodies stay on disk for build() to send, conditional()
+    gives the same 404 if it finds them gone.
+    """
+    if file['body'] is not None or not file_cache.fits(file['size']):
+        return True
+    try:
+        file['body'] = blobs.read_bytes(file['content_hash'])
+    except FileNotFoundError:
+        return False
+    file_cache.put(file, file.pop('generation'))
+    return True
+
+def parse_field(field):
+    """Split a fields= entry like a.b[0].c (or $.a.b[0].c) into keys and indexes."""
+    if field == '$':
+        return []
+    if field.startswith('$.'):
+        field = field[2:]
+    steps = []
+    for segment in field.split('.'):
+        match = _PATH_STEP.fullmatch(segment)
+        if match is None:
+            raise ValueError(field)
+        steps.append(match.group(1))
+        steps.extend(int(index) for index in re.findall(r'\d+', match.group(2)))
+    return steps
+
+def json_path(steps):
+    return '$' + ''.join(f'[{step}]' if isinstance(step, int) else f'."{step}"' for step in steps)
+
+def walk(document, steps):
+    for step in steps:
+        if isinstance(step, int) and isinstance(document, list) and step < len(document):
+            document = document[step]
+        elif isinstance(step, str) and isinstance(document, dict) and step in document:
+            document = document[step]
+        else:
+            return None
+    return document
+
+def projection_response(file, fields):
+    """{field: value} for each of fields in the file's document.
+
+    The document is parsed by sqlite's json_extract() and only the selected
+    values come back, so large documents never become Python objects.
+    Paths that don't exist are null. Documents stored before content was
+    validated may not be JSON at all, those get a 422.
+    """
+    steps = [parse_field(field) for field in fields]
+    if file['body'] is not None:
+        text = file['body'].decode('utf-8')
+    else:
+        text = blobs.read_text(file['content_hash'])
+    paths = [json_path(path) for path in steps]
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            if len(paths) == 1:
+                # With a single path json_extract() returns a bare SQL value
+                cursor.execute("SELECT json_quote(json_extract(?, ?))", (text, paths[0]))
+                values = [json.loads(cursor.fetchone()[0])]
+            else:
+                cursor.execute(f"SELECT json_extract(?, {', '.join('?' * len(paths))})", (text, *paths))
+                values = json.loads(cursor.fetchone()[0])
+    except sqlite3.OperationalError:
+        # sqlite's parser rejects the NaN and Infinity that json.loads accepts
+        try:
+            document = json.loads(text)
+        except ValueError:
+            return jsonify({'message': 'File content is not valid JSON'}), 422
+        values = [walk(document, path) for path in steps]
+    return jsonify(dict(zip(fields, values)))
+
+def conditional(file, build, variant=None):
+    """Return build(encoding) tagged with an ETag, or a bare 304 if the client has it.
 
-    return pattern.search(input)
+    The ETag is the content hash stored with the row at write time, so a
+    revalidation costs at most one indexed lookup and never opens the blob,
+    the body is only loaded when build() is about to run. Large
+    bodies are compressed if the client accepts it, each encoding is its
+    own representation with its own ETag. A variant names a representation
+    derived from the content (e.g. a projection), those go out uncompressed.
+    """
+    encoding = None if variant else compression.negotiate(file['size'])
+    etag = '-'.join(part for part in (file['content_hash'], variant, encoding) if part)
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        try:
+            if not load_body(file):
+                raise FileNotFoundError(file['content_hash'])
+            response = current_app.make_response(build(encoding))
+        except FileNotFoundError:
+            # Deleted and released since the row was read
+            return jsonify({'message': 'File not found'}), 404
+        if response.status_code != 200:
+            # Errors aren't a representation of the file
+            return response
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # Per-user responses, browsers may keep them but must revalidate
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
         
 @file_bp.route('/files', methods=['POST'])
@@ -33,88 +363,108 @@ def create_file():
     filename = uuid.uuid4().hex
     content = data.get('content', '')
 
-    if waf(content):
-        return jsonify({'message': 'Attack detected!'}), 400
-    print(f"Creating file for user_id {session['user_id']} with filename {filename}")
-    with get_db_connection() as conn:
+    content, error = check_content(content)
+    if error:
+        message, status = error
+        return jsonify({'message': message}), status
+
+    with get_files_connection(session['user_id']) as conn:
         cursor = conn.cursor()
-        cursor.execute("INSERT INTO files (user_id, filename, content) VALUES (?, ?, ?)", 
-                       (session['user_id'], filename, content))
+        insert_files(cursor, [(session['user_id'], filename, content, time.time())])
         conn.commit()
+    restore_blobs([content])
 
-    print(f"File {filename} created for user_id {session['user_id']}")
+    log.info('File created', extra={'user_id': session['user_id'], 'file': filename})
 
     return jsonify({'message': 'File created successfully', 'name': filename}), 201
 
-@file_bp.route('/files/details/<string:filename>', methods=['GET'])
-def get_file(filename):
-    print(f"session data: {session}")  # Debugging line
+@file_bp.route('/files/upload', methods=['POST'])
+def upload_file():
+    """Create a file from a raw JSON request body, read as a stream.
+
+    Unlike create_file() the body is the document itself, not wrapped in
+    {"content": ...}, and it is stored as sent rather than re-serialized.
+    Documents can be up to UPLOAD_MAX_BYTES (64 MiB), all of it scanned by
+    the WAF, against WAF_MAX_SCAN_BYTES (8 MiB) for create_file(). Only
+    the first SEARCH_INDEX_MAX_BYTES are read back for the search index,
+    so memory stays bounded by that and the upload chunk size.
+    """
     if 'user_id' not in session:
         return jsonify({'message': 'Unauthorized'}), 401
-    print(f'Admin status: {session["admin"]}====================22')
+    if request.content_length is not None and request.content_length > UPLOAD_MAX_BYTES:
+        return jsonify({'message': f'Upload larger than {UPLOAD_MAX_BYTES} bytes'}), 413
 
-    if session['admin']:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM files WHERE filename = ?', (filename,))
-            file = cursor.fetchone()
+    writer = blobs.BlobWriter()
+    try:
+        error = stream_upload(request.stream, writer)
+    except BaseException:
+        writer.abort()
+        raise
+    if error:
+        writer.abort()
+        return error
 
-        if file is None:
-            return jsonify({'message': 'File not found'}), 404
+    filename = uuid.uuid4().hex
+    try:
+        digest, size = writer.commit()
+        # The search index needs the text itself, read its start back once
+        content = blobs.read_prefix(digest, SEARCH_INDEX_MAX_BYTES)
+        with get_files_connection(session['user_id']) as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO files (user_id, filename, content_hash, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                           (session['user_id'], filename, digest, size, time.time()))
+            cursor.execute("INSERT INTO files_fts (rowid, content) VALUES (?, ?)", (cursor.lastrowid, content))
+            conn.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    writer.restore()
 
-        return jsonify({'filename': file['filename'], 'content': file['content']})
-    else:
+    return jsonify({'message': 'File created successfully', 'name': filename}), 201
 
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM files WHERE filename = ? AND user_id = ?", 
-                        (filename, session['user_id']))
-            file = cursor.fetchone()
+@file_bp.route('/files/details/<string:filename>', methods=['GET'])
+def get_file(filename):
+    if 'user_id' not in session:
+        return jsonify({'message': 'Unauthorized'}), 401
+    log.debug('File details requested', extra={'user_id': session['user_id'], 'admin': session['admin'], 'file': filename})
 
-        if file is None:
-            return jsonify({'message': 'File not found'}), 404
+    file = find_file(filename)
+    if file is None:
+        return jsonify({'message': 'File not found'}), 404
 
-        return jsonify({'filename': file['filename'], 'content': file['content']})
+    return conditional(file, lambda encoding: details_response(file, encoding))
 
 @file_bp.route('/files/content/<string:filename>', methods=['GET'])
 def get_file_content(filename):
-    print(f"session data2: {session}")  # Debugging line
     if 'user_id' not in session:
         return jsonify({'message': 'Unauthorized'}), 401
-    print(f'Admin status: {session["admin"]}====================')
-    if session['admin'] == 1:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT content FROM files WHERE filename = ?", 
-                        (filename,))
-            file = cursor.fetchone()
-
-        if file is None:
-            return jsonify({'message': 'File not found'}), 404
-        return jsonify(json.loads(file['content']))
-    else:
+    log.debug('File content requested', extra={'user_id': session['user_id'], 'admin': session['admin'], 'file': filename})
 
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT content FROM files WHERE filename = ? AND user_id = ?", 
-                        (filename, session['user_id']))
-            file = cursor.fetchone()
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    if len(fields) > MAX_PROJECTION_FIELDS:
+        return jsonify({'message': f'At most {MAX_PROJECTION_FIELDS} fields'}), 400
+    try:
+        for field in fields:
+            parse_field(field)
+    except ValueError:
+        return jsonify({'message': 'Invalid field path'}), 400
 
-        if file is None:
-            return jsonify({'message': 'File not found'}), 404
+    file = find_file(filename)
+    if file is None:
+        return jsonify({'message': 'File not found'}), 404
 
-        return jsonify(json.loads(file['content']))
+    if fields:
+        variant = 'fields-' + hashlib.sha256(','.join(fields).encode()).hexdigest()[:16]
+        return conditional(file, lambda encoding: projection_response(file, fields), variant)
+    return conditional(file, lambda encoding: json_response(file, encoding))
 
 @file_bp.route('/files/<string:filename>', methods=['POST'])
 def update_visits(filename):
     if 'user_id' not in session:
         return jsonify({'message': 'Unauthorized'}), 401
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE files SET visits = visits + 1 WHERE filename = ? AND user_id = ?", 
-                       (filename, session['user_id']))
-        conn.commit()
+    # Buffered and written in batches, see blueprints/visits.py
+    visit_counter.add(filename, session['user_id'])
 
     return jsonify({'message': 'File visits updated successfully'})
 
@@ -123,22 +473,193 @@ def delete_file(filename):
     if 'user_id' not in session:
         return jsonify({'message': 'Unauthorized'}), 401
 
-    with get_db_connection() as conn:
+    with get_files_connection(session['user_id']) as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM files WHERE filename = ? AND user_id = ?", 
+        cursor.execute("DELETE FROM files WHERE filename = ? AND user_id = ? RETURNING content_hash", 
                        (filename, session['user_id']))
+        released = [row['content_hash'] for row in cursor.fetchall()]
         conn.commit()
+        if released:
+            file_cache.invalidate([filename])
+        blobs.release(shard_connections(), released)
+    for digest in released:
+        blobs.discard_variants(digest, filename)
 
     return jsonify({'message': 'File deleted successfully'})
 
+@file_bp.route('/files/batch', methods=['POST'])
+def create_files_batch():
+    if 'user_id' not in session:
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    items, error = read_batch()
+    if error:
+        return error
+
+    results = []
+    rows = []
+    now = time.time()
+    for index, item in enumerate(items):
+        content = item.get('content', '') if isinstance(item, dict) else None
+        content, error = check_content(content)
+        if error:
+            message, status = error
+            results.append({'index': index, 'status': status, 'message': message})
+            continue
+        filename = uuid.uuid4().hex
+        rows.append((session['user_id'], filename, content, now))
+        results.append({'index': index, 'status': 201, 'name': filename})
+
+    if rows:
+        with get_files_connection(session['user_id']) as conn:
+            insert_files(conn.cursor(), rows)
+        restore_blobs(content for _, _, content, _ in rows)
+
+    return jsonify({'message': f'{len(rows)} of {len(items)} files created', 'results': results}), 200
+
+@file_bp.route('/files/batch', methods=['DELETE'])
+def delete_files_batch():
+    if 'user_id' not in session:
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    items, error = read_batch()
+    if error:
+        return error
+    filenames = [item for item in items if isinstance(item, str)]
+
+    with get_files_connection(session['user_id']) as conn:
+        cursor = conn.cursor()
+        owned = {}
+        if filenames:
+            placeholders = ', '.join('?' * len(filenames))
+            cursor.execute(f"SELECT filename, content_hash, size FROM files WHERE user_id = ? AND filename IN ({placeholders})",
+                           [session['user_id'], *filenames])
+            owned = {row['filename']: row['content_hash'] for row in cursor.fetchall()}
+        cursor.executemany("DELETE FROM files WHERE filename = ? AND user_id = ?",
+                           [(filename, session['user_id']) for filename in owned])
+    if owned:
+        file_cache.invalidate(owned)
+    blobs.release(shard_connections(), owned.values())
+    for filename, digest in owned.items():
+        blobs.discard_variants(digest, filename)
+
+    results = []
+    for index, item in enumerate(items):
+        if not isinstance(item, str):
+            results.append({'index': index, 'status': 400, 'message': 'Expected a file name'})
+        else:
+            results.append({'index': index, 'filename': item, 'status': 200 if item in owned else 404})
+    return jsonify({'message': f'{len(owned)} files deleted', 'results': results}), 200
+
 @file_bp.route('/files', methods=['GET'])
 def get_all_files():
     if 'user_id' not in session:
         return jsonify({'message': 'Unauthorized'}), 401
-    
-    with get_db_connection() as conn:
+
+    limit = request.args.get('limit', type=int)
+    after = request.args.get('after', 0, type=int)
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    unknown = [field for field in fields if field not in FILE_LIST_FIELDS]
+    if unknown:
+        return jsonify({'message': f"Unknown fields: {', '.join(unknown)}"}), 400
+
+    columns = ', '.join(['id', 'filename'] + [FILE_LIST_FIELDS[field] for field in fields])
+    query = f"SELECT {columns} FROM files WHERE user_id = ? AND id > ? ORDER BY id"
+    params = [session['user_id'], after]
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        # One extra row tells us whether there is another page
+        query += " LIMIT ?"
+        params.append(limit + 1)
+
+    with get_files_connection(session['user_id']) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT filename FROM files WHERE user_id = ?", (session['user_id'],))
-        files = [row[0] for row in cursor.fetchall()]
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]['id']
+
+    if fields:
+        files = [dict(row) for row in rows]
+        for file in files:
+            del file['id']
+            if 'visits' in file:
+                # Merge in increments that haven't been flushed yet
+                file['visits'] += visit_counter.pending(file['filename'], session['user_id'])
+    else:
+        files = [row['filename'] for row in rows]
+
+    return jsonify({'files': files, 'next': next_cursor})
+
+def export_lines(user_id, after, limit):
+    """Yield one NDJSON line per file of user_id with an id above after.
+
+    Rows are read in keyset batches of EXPORT_BATCH_ROWS rather than through
+    one long-running statement, so a slow client never pins a read snapshot
+    (which would stop the WAL from being checkpointed). Only one batch of
+    rows and one document are held at a time.
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        batch = EXPORT_BATCH_ROWS if remaining is None else min(EXPORT_BATCH_ROWS, remaining)
+        with get_files_connection(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, filename, content_hash, size, created_at FROM files
+                WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?
+            """, (user_id, after, batch))
+            rows = cursor.fetchall()
+        for row in rows:
+            try:
+                content = blobs.read_text(row['content_hash'])
+            except FileNotFoundError:
+                # Deleted while we were exporting
+                continue
+            yield json.dumps({'id': row['id'], 'filename': row['filename'], 'size': row['size'],
+                              'created': row['created_at'], 'content': content}, separators=(',', ':')) + '\n'
+        if len(rows) < batch:
+            return
+        after = rows[-1]['id']
+        if remaining is not None:
+            remaining -= len(rows)
+
+def chunked(lines, size):
+    """Join lines into chunks of about size characters."""
+    buffer = []
+    buffered = 0
+    for line in lines:
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+@file_bp.route('/files/export', methods=['GET'])
+def export_files():
+    """Stream all of the user's files as NDJSON, oldest first.
+
+    Each line is {"id", "filename", "size", "created", "content"} with the
+    document as a string, like the details endpoint. A client that lost the
+    connection resumes with ?after=<id of the last complete line>; ?limit=
+    caps the number of lines.
+    """
+    if 'user_id' not in session:
+        return jsonify({'message': 'Unauthorized'}), 401
+
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(0, limit)
 
-    return jsonify({'files': files})
\ No newline at end of file
+    lines = export_lines(session['user_id'], after, limit)
+    response = current_app.response_class(stream_with_context(chunked(lines, EXPORT_CHUNK_BYTES)),
+                                          mimetype='application/x-ndjson')
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
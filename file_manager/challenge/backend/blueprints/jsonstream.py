@@ -0,0 +1,187 @@
+import json
+import re
+import sys
+from json.encoder import encode_basestring_ascii
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Possessive, so a string that isn't closed yet fails in linear time
+_STRING_CHARS = r'(?:[^"\\\x00-\x1f]++|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*+'
+# One complete token and the whitespace before it
+_TOKEN = re.compile(r'''[ \t\n\r]*(?:
+    (?P<string>"%s")
+   |(?P<punct>[{}\[\]:,])
+   |(?P<scalar>true|false|null|NaN|-?Infinity|-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?)
+)''' % _STRING_CHARS, re.X)
+# A string body that goes on in the next piece
+_STRING_BODY = re.compile(_STRING_CHARS)
+_PARTIAL_ESCAPE = re.compile(r'\\(?:u[0-9a-fA-F]{0,3})?\Z')
+# Characters a number is made of, a number ends at the first other one
+_NUMBER_RUN = re.compile(r'[-+.eE0-9]*')
+# json.loads accepts the non-standard constants too
+_LITERALS = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+_LONGEST_LITERAL = max(map(len, _LITERALS))
+# Containers that end within the piece are parsed by json's C scanner. One
+# that runs past the end fails there, and so does every container around it,
+# so give up on the fast path for the rest of a piece after a few failures.
+_scan_once = json.JSONDecoder().scan_once
+_encode_compact = json.JSONEncoder(separators=(',', ':')).encode
+_SCAN_ATTEMPTS = 4
+# Longer numbers are rejected instead of being buffered across pieces
+MAX_NUMBER_LENGTH = sys.get_int_max_str_digits() or 4300
+
+
+def _canonical_string(body):
+    """A string body escaped the way json.dumps writes it."""
+    if body.isascii() and '\\' not in body and '\x7f' not in body:
+        return body
+    return encode_basestring_ascii(json.loads('"' + body + '"'))[1:-1]
+
+
+class JsonStreamValidator:
+    """Checks JSON syntax for a document that arrives in pieces.
+
+    feed() raises ValueError as soon as the text can no longer be valid JSON.
+    Only an unfinished token is buffered between pieces, and string bodies
+    are consumed as they come, so a large string doesn't have to fit in
+    memory.
+
+    feed() returns the tokens it consumed in compact form, with string
+    escapes normalised the way json.dumps writes them. That's the streaming
+    counterpart of the canonical text the WAF checks for regular uploads,
+    minus the key sorting, which needs the whole document.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._stack = []
+        self._expect = 'value'
+        self._in_string = False
+
+    def feed(self, text, final=False):
+        buffer = self._buffer + text
+        out = []
+        pos = 0
+        attempts = _SCAN_ATTEMPTS
+
+        while True:
+            if self._in_string:
+                pos = self._string_body(buffer, pos, out, final)
+                if self._in_string:
+                    break
+                continue
+
+            if attempts and self._expect in ('value', 'value_or_end'):
+                start = _WHITESPACE.match(buffer, pos).end()
+                if start < len(buffer) and buffer[start] in '{[':
+                    try:
+                        value, pos = _scan_once(buffer, start)
+                    except (ValueError, StopIteration, RecursionError):
+                        attempts -= 1
+                    else:
+                        self._after_value()
+                        out.append(_encode_compact(value))
+                        continue
+
+            match = _TOKEN.match(buffer, pos)
+            kind = match and match.lastgroup
+            if kind == 'scalar' and not final and \
+                    _NUMBER_RUN.match(buffer, match.start(kind)).end() == len(buffer):
+                # The number may go on in the next piece
+                match = None
+
+            if match is None:
+                pos = _WHITESPACE.match(buffer, pos).end()
+                if pos == len(buffer):
+                    break
+                if buffer[pos] == '"':
+                    # A string that doesn't end in this piece
+                    self._open_string()
+                    self._in_string = True
+                    out.append('"')
+                    pos += 1
+                    continue
+                if not final and self._partial_scalar(buffer, pos):
+                    break
+                raise ValueError(f"Unexpected {buffer[pos]!r}")
+
+            token = match.group(kind)
+            if kind == 'string':
+                self._open_string()
+                self._close_string()
+                out.append('"' + _canonical_string(token[1:-1]) + '"')
+            elif kind == 'scalar':
+                self._value()
+                self._after_value()
+                out.append(token)
+            else:
+                self._punct(token)
+                out.append(token)
+            pos = match.end()
+
+        self._buffer = buffer[pos:]
+        if final and (self._expect != 'done' or self._in_string or self._buffer):
+            raise ValueError('Unexpected end of document')
+        return ''.join(out)
+
+    def _partial_scalar(self, buffer, pos):
+        """True if buffer ends with the start of a number or constant."""
+        end = _NUMBER_RUN.match(buffer, pos).end()
+        if end == len(buffer) and end > pos:
+            if end - pos > MAX_NUMBER_LENGTH:
+                raise ValueError('Number too long')
+            return True
+        rest = buffer[pos:pos + _LONGEST_LITERAL]
+        return any(literal.startswith(rest) for literal in _LITERALS)
+
+    def _string_body(self, buffer, pos, out, final):
+        end = _STRING_BODY.match(buffer, pos).end()
+        closed = end < len(buffer) and buffer[end] == '"'
+        if not closed and end < len(buffer) and (final or not _PARTIAL_ESCAPE.match(buffer, end)):
+            raise ValueError('Invalid string')
+        if end > pos:
+            out.append(_canonical_string(buffer[pos:end]))
+        if not closed:
+            return end
+        self._in_string = False
+        self._close_string()
+        out.append('"')
+        return end + 1
+
+    def _open_string(self):
+        if self._expect in ('key', 'key_or_end'):
+            self._expect = 'colon'
+        else:
+            self._value()
+
+    def _close_string(self):
+        if self._expect != 'colon':
+            self._after_value()
+
+    def _punct(self, char):
+        expect = self._expect
+        if char in '{[':
+            self._value()
+            self._stack.append(char)
+            self._expect = 'key_or_end' if char == '{' else 'value_or_end'
+        elif char == ':':
+            if expect != 'colon':
+                raise ValueError("Unexpected ':'")
+            self._expect = 'value'
+        elif char == ',':
+            if expect != 'comma_or_end':
+                raise ValueError("Unexpected ','")
+            self._expect = 'key' if self._stack[-1] == '{' else 'value'
+        else:
+            opener = '{' if char == '}' else '['
+            if not self._stack or self._stack[-1] != opener or \
+                    expect not in ('comma_or_end', 'key_or_end' if char == '}' else 'value_or_end'):
+                raise ValueError(f"Unexpected '{char}'")
+            self._stack.pop()
+            self._after_value()
+
+    def _value(self):
+        if self._expect not in ('value', 'value_or_end'):
+            raise ValueError('Unexpected value')
+
+    def _after_value(self):
+        self._expect = 'comma_or_end' if self._stack else 'done'
@@ -0,0 +1,168 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+# Per-logger overrides, e.g. "blueprints.files=DEBUG,werkzeug=WARNING"
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+# "json" for one object per line, "text" for people
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+# Share of DEBUG records that are kept, the rest are dropped at the call site
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.01))
+
+# Attributes every LogRecord has, anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+def fields(record):
+    """The structured fields passed to a log call through extra=."""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            **fields(record),
+        }
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        extra = ' '.join(f'{key}={value}' for key, value in fields(record).items())
+        return f'{line} {extra}' if extra else line
+
+
+class DebugSampler(logging.Filter):
+    """Keeps a random share of DEBUG records and tags them with the rate."""
+
+    def __init__(self, rate=LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        if random.random() >= self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Render the message and traceback here, the listener thread must not
+        # touch the arguments after the caller has moved on
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        super().emit(record)
+        if _autostart and not _running:
+            start()
+
+
+_listener = None
+_running = False
+# Whether the first record starts the listener, see _after_fork()
+_autostart = False
+_lock = threading.Lock()
+
+
+def _install():
+    """Put a new queue handler on the root logger, with a listener not started yet."""
+    global _listener
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+    handler = _QueueHandler(records)
+    handler.addFilter(DebugSampler())
+
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, _QueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+
+
+def start():
+    """Start the listener thread, records logged until now are written first."""
+    global _running
+    with _lock:
+        if _listener is not None and not _running:
+            _listener.start()
+            _running = True
+
+
+def stop():
+    """Write out what is queued and stop the thread, the next record starts it again."""
+    global _running, _autostart
+    with _lock:
+        if _listener is None:
+            return
+        if not _running:
+            _listener.start()
+        _listener.stop()
+        _running = False
+        _autostart = True
+
+
+def _after_fork():
+    global _lock, _running, _autostart
+    # The listener thread and the parent's queued records stay with the
+    # parent. A forked child starts its own listener on its first record,
+    # so it can still fork processes of its own before then without a
+    # thread running.
+    _lock = threading.Lock()
+    _running = False
+    _autostart = True
+    _install()
+
+
+def setup():
+    """Route all logging through a queue to a background writer thread.
+
+    Callers only pay for putting a record on the queue, formatting and the
+    write to stdout happen on the listener thread. The thread is only
+    started by start(), so the app can fork its worker processes first;
+    records logged before then wait in the queue. Safe to call more than
+    once.
+    """
+    with _lock:
+        if _listener is not None:
+            return
+        root = logging.getLogger()
+        root.setLevel(LOG_LEVEL.upper())
+        for item in filter(None, LOG_LEVELS.split(',')):
+            name, _, level = item.partition('=')
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+        _install()
+        atexit.register(stop)
+        os.register_at_fork(after_in_child=_after_fork)
+
+
+def init_app(app):
+    setup()
@@ -0,0 +1,348 @@
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from flask import Blueprint, Response, request
+
+from .database import pool_stats, start_db_timer, stop_db_timer
+from .filecache import cache as file_cache
+from .visits import counter as visit_counter
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+METRICS_BUCKETS = [float(bound) for bound in os.environ.get(
+    'METRICS_BUCKETS', '0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10').split(',')]
+# Every process that serves requests leaves a snapshot of its numbers here
+# and /metrics adds them all up, whichever worker gets the scrape. Made at
+# import, before the server forks its workers, so they all share it.
+METRICS_DIR = os.environ.get('METRICS_DIR') or tempfile.mkdtemp(prefix='metrics-')
+# Seconds between snapshots, how far behind the other workers /metrics can be
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class RequestMetrics:
+    """Request counts and latency histograms per blueprint and endpoint.
+
+    observe() is a dict lookup and a bisect under one lock, cheap enough to
+    leave on for every request. Numbers are per process, snapshot() and
+    add() carry them between processes.
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)
+        self._latency = {}
+        self._db_time = {}
+
+    def observe(self, blueprint, endpoint, method, status, seconds, db_seconds):
+        route = (blueprint, endpoint)
+        with self._lock:
+            self._requests[route + (method, status)] += 1
+            latency = self._latency.get(route)
+            if latency is None:
+                latency = self._latency[route] = Histogram(self.buckets)
+                self._db_time[route] = Histogram(self.buckets)
+            latency.observe(seconds)
+            self._db_time[route].observe(db_seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': [list(key) + [count] for key, count in self._requests.items()],
+                'latency': [list(route) + [h.counts, h.sum] for route, h in self._latency.items()],
+                'db_time': [list(route) + [h.counts, h.sum] for route, h in self._db_time.items()],
+            }
+
+    def add(self, snapshot):
+        """Add the numbers of another process's snapshot() to these."""
+        with self._lock:
+            for *key, count in snapshot['requests']:
+                self._requests[tuple(key)] += count
+            for name, series in [('latency', self._latency), ('db_time', self._db_time)]:
+                for blueprint, endpoint, counts, total in snapshot[name]:
+                    histogram = series.get((blueprint, endpoint))
+                    if histogram is None:
+                        histogram = series[(blueprint, endpoint)] = Histogram(self.buckets)
+                    if len(counts) != len(histogram.counts):
+                        # Taken with other METRICS_BUCKETS
+                        continue
+                    histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                    histogram.sum += total
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            requests = dict(self._requests)
+            histograms = [
+                ('http_request_duration_seconds', 'Request latency by blueprint and endpoint.', self._latency),
+                ('http_request_db_seconds', 'Time spent in the database per request.', self._db_time),
+            ]
+            lines = [
+                '# HELP http_requests_total Requests by blueprint, endpoint, method and status.',
+                '# TYPE http_requests_total counter',
+            ]
+            for (blueprint, endpoint, method, status), count in sorted(requests.items()):
+                labels = _labels(blueprint=blueprint, endpoint=endpoint, method=method, status=status)
+                lines.append(f'http_requests_total{{{labels}}} {count}')
+
+            for name, help, series in histograms:
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} histogram')
+                for (blueprint, endpoint), histogram in sorted(series.items()):
+                    labels = _labels(blueprint=blueprint, endpoint=endpoint)
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + ['+Inf'], histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
+registry = RequestMetrics()
+
+
+# [start time, status] of the request being served
+_current = contextvars.ContextVar('metrics_request', default=None)
+
+
+def _start_timer():
+    _current.set([time.perf_counter(), 500])
+    start_db_timer()
+
+
+def _record_status(response):
+    state = _current.get()
+    if state is not None:
+        state[1] = response.status_code
+    return response
+
+
+def _observe(exception=None):
+    state = _current.get()
+    if state is None:
+        return
+    _current.set(None)
+    req = request._get_current_object()
+    registry.observe(req.blueprint or '', req.endpoint or 'unmatched', req.method, state[1],
+                     time.perf_counter() - state[0], stop_db_timer())
+    if _flusher is None:
+        _start_flusher()
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+_owner = os.getpid()
+
+# Stats of the process's other parts: group -> (label, [(key, metric,
+# kind, help)]). Counters are added up and kept after a process exits,
+# gauges are added up over the live processes and max is their largest.
+STATS = {
+    'file_cache': (None, [
+        ('hits', 'hits_total', 'counter', 'Reads answered from the file read cache.'),
+        ('misses', 'misses_total', 'counter', 'Reads that went to the database.'),
+        ('evictions', 'evictions_total', 'counter', 'Entries evicted to stay under the size limit.'),
+        ('invalidations', 'invalidations_total', 'counter', 'Entries dropped because a file was deleted.'),
+        ('entries', 'entries', 'gauge', 'Files currently cached.'),
+        ('bytes', 'bytes', 'gauge', 'Bytes currently cached.'),
+        ('max_bytes', 'max_bytes', 'max', 'Size limit of the cache in each process.'),
+    ]),
+    'db_pool': ('shard', [
+        ('size', 'size', 'gauge', 'Connections the pools may open.'),
+        ('open', 'open', 'gauge', 'Connections currently open.'),
+        ('in_use', 'in_use', 'gauge', 'Connections checked out by requests.'),
+        ('idle', 'idle', 'gauge', 'Open connections waiting in the pools.'),
+        ('checkouts', 'checkouts_total', 'counter', 'Connections handed out.'),
+        ('waits', 'waits_total', 'counter', 'Checkouts that had to wait for a connection.'),
+        ('wait_time_total', 'wait_seconds_total', 'counter', 'Time spent waiting for a connection.'),
+        ('wait_time_max', 'wait_seconds_max', 'max', 'Longest wait for a connection.'),
+    ]),
+    'visits': (None, [
+        ('pending', 'pending', 'gauge', 'Visit increments not written to the database yet.'),
+    ]),
+}
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f'{pid}.json')
+
+
+def _write(path, snapshot):
+    tmp = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def publish():
+    """Write this process's numbers to METRICS_DIR."""
+    _write(_snapshot_path(os.getpid()), {
+        'requests': registry.snapshot(),
+        'stats': {
+            'file_cache': {'': file_cache.stats()},
+            'db_pool': {str(shard): stats for shard, stats in pool_stats().items()},
+            'visits': {'': {'pending': visit_counter.pending()}},
+        },
+    })
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            publish()
+        except OSError:
+            log.warning('Writing the metrics snapshot failed', exc_info=True)
+
+
+def _start_flusher():
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='metrics-flusher', daemon=True)
+            _flusher.start()
+
+
+def _after_fork():
+    global _flusher, _flusher_lock
+    # The flusher thread stays with the parent, a child starts its own on
+    # its first request
+    _flusher = None
+    _flusher_lock = threading.Lock()
+
+
+def _add_stats(total, stats, counters_only=False):
+    for group, (_, spec) in STATS.items():
+        for value, numbers in stats.get(group, {}).items():
+            into = total.setdefault(group, {}).setdefault(value, {})
+            for key, _, kind, _ in spec:
+                if key not in numbers or (counters_only and kind != 'counter'):
+                    continue
+                if kind == 'max':
+                    into[key] = max(into.get(key, 0), numbers[key])
+                else:
+                    into[key] = into.get(key, 0) + numbers[key]
+
+
+def collect():
+    """Add up the snapshots in METRICS_DIR, this process's written just now.
+
+    Returns the request metrics and the STATS of all processes.
+    """
+    publish()
+    requests = RequestMetrics()
+    stats = {}
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            # Retired between listdir() and open()
+            continue
+        requests.add(snapshot['requests'])
+        _add_stats(stats, snapshot['stats'])
+    return requests, stats
+
+
+def retire(pid):
+    """Fold the counters of a process that exited into retired.json.
+
+    Its gauges are dropped and the snapshot removed, its counters stay in
+    the totals so they never go down.
+    """
+    try:
+        with open(_snapshot_path(pid)) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return
+    path = os.path.join(METRICS_DIR, 'retired.json')
+    requests = RequestMetrics()
+    stats = {}
+    try:
+        with open(path) as f:
+            retired = json.load(f)
+        requests.add(retired['requests'])
+        stats = retired['stats']
+    except (OSError, ValueError):
+        pass
+    requests.add(snapshot['requests'])
+    _add_stats(stats, snapshot['stats'], counters_only=True)
+    _write(path, {'requests': requests.snapshot(), 'stats': stats})
+    os.unlink(_snapshot_path(pid))
+
+
+def _remove_dir():
+    # Forked processes inherit the handler, only the one that made it cleans up
+    if os.getpid() == _owner:
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+
+
+def render_stats(stats):
+    lines = []
+    for group, (label, spec) in STATS.items():
+        series = sorted(stats.get(group, {}).items())
+        for key, metric, kind, help in spec:
+            name = f'{group}_{metric}'
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {"counter" if kind == "counter" else "gauge"}']
+            for value, numbers in series:
+                labels = '{' + _labels(**{label: value}) + '}' if label else ''
+                lines.append(f'{name}{labels} {numbers.get(key, 0)}')
+    return '\n'.join(lines) + '\n'
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    requests, stats = collect()
+    body = requests.render() + render_stats(stats)
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Time every request and expose the numbers on /metrics.
+
+    Must run before the server forks its workers, /metrics adds up the
+    numbers of every process forked from this one.
+    """
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_DIR):
+        # Left by an earlier run in the same METRICS_DIR
+        if name.endswith('.json'):
+            os.unlink(os.path.join(METRICS_DIR, name))
+    if 'METRICS_DIR' not in os.environ:
+        atexit.register(_remove_dir)
+    os.register_at_fork(after_in_child=_after_fork)
+    app.before_request(_start_timer)
+    app.after_request(_record_status)
+    app.teardown_request(_observe)
+    app.register_blueprint(metrics_bp)
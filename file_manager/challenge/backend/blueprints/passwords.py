@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Any method werkzeug understands, including its cost parameters,
+# e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+# Hashing processes, 0 hashes inline in the request thread
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+# Hashes allowed in flight (running or queued) at once
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 4 * max(PASSWORD_HASH_WORKERS, 1)))
+# Seconds a request waits for a free slot before giving up
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+
+
+class HasherBusy(Exception):
+    """No hashing slot became free within the queue timeout."""
+
+
+class PasswordHasher:
+    """Runs werkzeug's password hashing in a separate pool of processes.
+
+    The hashes are deliberately slow and keep a core busy, in the request
+    thread they stall every other request the process is serving. At most
+    max_pending hashes are in flight; a caller that can't get a slot within
+    timeout seconds gets HasherBusy instead of queueing without bound.
+    """
+
+    def __init__(self, method=PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS,
+                 max_pending=PASSWORD_HASH_MAX_PENDING, timeout=PASSWORD_HASH_TIMEOUT):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._prefix = None
+        os.register_at_fork(after_in_child=self._forget)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was made with other parameters than self.method."""
+        if self._prefix is None:
+            # werkzeug fills in the default cost, hash once to learn the full form
+            self._prefix = self.hash('').split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    def start(self):
+        """Fork the worker processes now, before the app starts its threads."""
+        if self.workers > 0:
+            self._pool().submit(int).result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    def _forget(self):
+        # The executor's threads and pipes belong to the parent, a forked
+        # child starts its own pool on first use
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def _run(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy()
+        try:
+            return self._pool().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # Forked like the report workers, spawn would re-run app.py
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+            return self._executor
+
+
+hasher = PasswordHasher()
+
+
+def init_app(app):
+    hasher.start()
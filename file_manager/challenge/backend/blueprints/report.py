@@ -1,14 +1,11 @@
-from playwright.sync_api import sync_playwright
 from urllib.parse import urlparse
 from flask import Blueprint, request, jsonify, session, url_for
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
 from .database import get_db_connection
+from . import report_queue
 report_bp = Blueprint('report', __name__)
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
 
 @report_bp.route('/report', methods=['POST'])
 def report():
@@ -22,56 +19,26 @@ def report():
 
         if reported_domain != base_domain:
             return jsonify({'message': "Invalid URL - Domain does not match"}), 400
-        
-        
 
-        username = 'admin'
-        password = os.environ['ADMIN_PASSWORD']
-        print(password)
-        import requests
-        request_session = requests.Session()
-        res = request_session.post(url_for('auth.login', _external=True), json={'username': username, 'password': password})
-            
-        print(f"Login status code: {res.status_code}")
+        with get_db_connection() as conn:
+            job_id = report_queue.enqueue(
+                conn,
+                session['user_id'],
+                url,
+                urlparse(url_for('report.report', _external=True)).hostname,
+            )
+
+        return jsonify({'message': f"Report queued for {url}", 'id': job_id}), 202
 
+@report_bp.route('/report/<int:job_id>', methods=['GET'])
+def report_status(job_id):
+    if 'user_id' not in session:
+        return jsonify({'message': 'Unauthorized'}), 401
 
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context()
-            
-            cookie = {
-                'name': 'session',
-                'value': request_session.cookies.get('session'),
-                'domain': urlparse(url_for('report.report', _external=True)).hostname,
-                'path': '/',
-                'httpOnly': True,
-                'secure': False,
-                'sameSite': 'Strict'
-            }
-            flag_cookie = {
-                'name': 'flag',
-                'value': os.environ['FLAG'],
-                'domain': urlparse(url_for('report.report', _external=True)).hostname,
-                'path': '/',
-                'httpOnly': False,
-                'secure': False,
-                'sameSite': 'Strict'
-            }
-            
-            print('------------')
-            print(flag_cookie)
-            print(cookie)
-            print('------------')
+    with get_db_connection() as conn:
+        job = report_queue.job_status(conn, job_id, session['user_id'])
 
-            context.add_cookies([cookie, flag_cookie])
-            page = context.new_page()
-            page.goto(url, wait_until="networkidle")
-            page.wait_for_load_state("domcontentloaded")            
-            page.wait_for_load_state("load")              
-            page.wait_for_timeout(2000)
-            
-            print(f"Bot successfully visited {url}")
+    if job is None:
+        return jsonify({'message': 'Report not found'}), 404
 
-            context.close()
-            browser.close()
-        return jsonify({"message": f"Bot successfully visited {url}"}), 200 
+    return jsonify(job)
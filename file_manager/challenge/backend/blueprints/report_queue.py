@@ -0,0 +1,255 @@
+import atexit
+import logging
+import os
+import signal
+import threading
+import time
+
+from .database import get_db_connection
+
+log = logging.getLogger(__name__)
+
+# Report worker settings
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+REPORT_WORKER_THREADS = int(os.environ.get('REPORT_WORKER_THREADS', os.environ.get('BROWSER_POOL_SIZE', 2)))
+REPORT_POLL_INTERVAL = float(os.environ.get('REPORT_POLL_INTERVAL', 0.5))
+ADMIN_SESSION_TTL = float(os.environ.get('ADMIN_SESSION_TTL', 3600))
+
+# Pids of the report worker processes this process started
+_workers = []
+_app = None
+_admin_session = {'value': None, 'expires': 0.0}
+_admin_session_lock = threading.Lock()
+
+
+def enqueue(conn, user_id, url, cookie_domain):
+    """Add a report to the queue and return its job id."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO report_jobs (user_id, url, cookie_domain, queued_at)
+        VALUES (?, ?, ?, ?)
+    """, (user_id, url, cookie_domain, time.time()))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def job_status(conn, job_id, user_id):
+    """Return a job's state and timings, or None if the user doesn't own it."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM report_jobs WHERE id = ? AND user_id = ?", (job_id, user_id))
+    job = cursor.fetchone()
+    if job is None:
+        return None
+
+    now = time.time()
+    started_at = job['started_at']
+    finished_at = job['finished_at']
+    status = {
+        'id': job['id'],
+        'url': job['url'],
+        'status': job['status'],
+        'error': job['error'],
+        'queued_at': job['queued_at'],
+        'started_at': started_at,
+        'finished_at': finished_at,
+        'wait_time': (started_at or now) - job['queued_at'],
+        'run_time': (finished_at or now) - started_at if started_at else None,
+        'queue_depth': None,
+    }
+    if job['status'] == 'queued':
+        # Number of jobs that will be picked up before this one
+        cursor.execute("SELECT COUNT(*) FROM report_jobs WHERE status = 'queued' AND id < ?", (job_id,))
+        status['queue_depth'] = cursor.fetchone()[0]
+    return status
+
+
+def claim_job(conn):
+    """Atomically move the oldest queued job to running and return it."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE report_jobs SET status = 'running', started_at = ?
+        WHERE id = (SELECT id FROM report_jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+          AND status = 'queued'
+        RETURNING *
+    """, (time.time(),))
+    job = cursor.fetchone()
+    conn.commit()
+    return job
+
+
+def finish_job(conn, job_id, error=None):
+    conn.execute("UPDATE report_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                 ('failed' if error else 'done', error, time.time(), job_id))
+    conn.commit()
+
+
+def requeue_running(conn):
+    """Put jobs left running by a dead worker back on the queue."""
+    conn.execute("UPDATE report_jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+    conn.commit()
+
+
+def admin_session_cookie():
+    """Return a signed admin session cookie, minting a new one once it expires.
+
+    The cookie is signed in-process with the app's session serializer, the
+    same way a successful /api/auth/login would, so the bot never has to go
+    through HTTP or the password hash check.
+    """
+    with _admin_session_lock:
+        now = time.time()
+        if _admin_session['value'] is None or now >= _admin_session['expires']:
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, admin FROM users WHERE username = 'admin'")
+                user = cursor.fetchone()
+            finally:
+                conn.close()
+
+            serializer = _app.session_interface.get_signing_serializer(_app)
+            _admin_session['value'] = serializer.dumps({
+                'user_id': user['id'],
+                'username': 'admin',
+                'admin': user['admin'],
+            })
+            lifetime = _app.permanent_session_lifetime.total_seconds()
+            _admin_session['expires'] = now + min(ADMIN_SESSION_TTL, lifetime)
+        return _admin_session['value']
+
+
+def run_job(job):
+    """Visit the reported URL as the admin bot."""
+    from .browser_pool import pool as browser_pool
+
+    url = job['url']
+
+    cookie = {
+        'name': 'session',
+        'value': admin_session_cookie(),
+        'domain': job['cookie_domain'],
+        'path': '/',
+        'httpOnly': True,
+        'secure': False,
+        'sameSite': 'Strict'
+    }
+    flag_cookie = {
+        'name': 'flag',
+        'value': os.environ['FLAG'],
+        'domain': job['cookie_domain'],
+        'path': '/',
+        'httpOnly': False,
+        'secure': False,
+        'sameSite': 'Strict'
+    }
+
+    log.debug('Bot cookies set', extra={'job_id': job['id'], 'cookie_domain': job['cookie_domain']})
+
+    def visit(context):
+        context.add_cookies([cookie, flag_cookie])
+        page = context.new_page()
+        page.goto(url, wait_until="networkidle")
+        page.wait_for_load_state("domcontentloaded")
+        page.wait_for_load_state("load")
+        page.wait_for_timeout(2000)
+
+        log.info('Bot visited url', extra={'job_id': job['id'], 'url': url})
+
+    browser_pool.visit(visit)
+
+
+def _claim_loop():
+    conn = get_db_connection()
+    # (job id, error) of a job that ran but whose outcome isn't recorded yet
+    unfinished = None
+    while True:
+        try:
+            if unfinished is not None:
+                finish_job(conn, *unfinished)
+                unfinished = None
+            job = claim_job(conn)
+            if job is None:
+                time.sleep(REPORT_POLL_INTERVAL)
+                continue
+            try:
+                run_job(job)
+            except Exception as e:
+                unfinished = (job['id'], repr(e))
+            else:
+                unfinished = (job['id'], None)
+            finish_job(conn, *unfinished)
+            unfinished = None
+        except Exception:
+            # e.g. "database is locked" after the busy timeout; keep the thread
+            # alive and record the held job's outcome on the next round
+            log.exception('Report worker loop failed', extra={'job_id': unfinished and unfinished[0]})
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            time.sleep(REPORT_POLL_INTERVAL)
+
+
+def worker_main(threads=REPORT_WORKER_THREADS):
+    """Entry point of a report worker process."""
+    from .browser_pool import pool as browser_pool
+    browser_pool.start()
+    loops = [threading.Thread(target=_claim_loop, daemon=True) for _ in range(threads)]
+    for loop in loops:
+        loop.start()
+    for loop in loops:
+        loop.join()
+
+
+def start_workers(count=REPORT_WORKERS):
+    """Fork the report worker processes.
+
+    Must run before the parent starts any threads of its own. They are
+    plain forks rather than multiprocessing processes, so nothing forked
+    from the parent later (e.g. the gunicorn workers) takes them for its
+    own children. Only the parent stops them, see stop_workers().
+    """
+    if _workers:
+        return
+    conn = get_db_connection()
+    try:
+        requeue_running(conn)
+    finally:
+        conn.close()
+
+    for _ in range(count):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                worker_main()
+                code = 0
+            except Exception:
+                log.exception('Report worker failed')
+            finally:
+                os._exit(code)
+        _workers.append(pid)
+    atexit.register(stop_workers)
+
+
+def stop_workers():
+    """Terminate the report workers and wait for them to exit."""
+    while _workers:
+        pid = _workers.pop()
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            # Already gone, or reaped by the server's SIGCHLD handler
+            pass
+
+
+# A forked process doesn't own its parent's report workers
+os.register_at_fork(after_in_child=_workers.clear)
+
+
+def init_app(app):
+    """Start the report workers alongside the app."""
+    global _app
+    _app = app
+    start_workers()
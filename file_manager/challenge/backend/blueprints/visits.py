@@ -0,0 +1,121 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+
+from .database import get_shard_connection, shard_for
+
+log = logging.getLogger(__name__)
+
+# Write-behind settings for the visit counters
+VISIT_FLUSH_INTERVAL_MS = int(os.environ.get('VISIT_FLUSH_INTERVAL_MS', 500))
+VISIT_FLUSH_THRESHOLD = int(os.environ.get('VISIT_FLUSH_THRESHOLD', 1000))
+
+
+class VisitCounter:
+    """Coalesces visit increments in memory and writes them in batches.
+
+    Increments are keyed by (filename, user_id), the same pair the UPDATE
+    matches on, so a batch applies exactly what the individual UPDATEs would
+    have. A background thread flushes every VISIT_FLUSH_INTERVAL_MS, or as
+    soon as VISIT_FLUSH_THRESHOLD increments are pending.
+    """
+
+    def __init__(self, interval_ms=VISIT_FLUSH_INTERVAL_MS, threshold=VISIT_FLUSH_THRESHOLD):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold
+        self._pending = Counter()
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._conns = {}
+        os.register_at_fork(after_in_child=self._forget)
+
+    def add(self, filename, user_id, count=1):
+        with self._lock:
+            self._pending[(filename, user_id)] += count
+            self._pending_total += count
+            full = self._pending_total >= self.threshold
+            if self._thread is None:
+                self._start()
+        if full:
+            self._wakeup.set()
+
+    def pending(self, filename=None, user_id=None):
+        """Unflushed increments, for one file or in total."""
+        with self._lock:
+            if filename is None:
+                return self._pending_total
+            return self._pending.get((filename, user_id), 0)
+
+    def flush(self):
+        """Write every pending increment, in one transaction per shard."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, Counter()
+                self._pending_total = 0
+            if not batch:
+                return 0
+
+            shards = defaultdict(Counter)
+            for (filename, user_id), count in batch.items():
+                shards[shard_for(user_id)][(filename, user_id)] = count
+            unwritten = list(shards.items())
+            try:
+                while unwritten:
+                    shard, increments = unwritten[0]
+                    if shard not in self._conns:
+                        self._conns[shard] = get_shard_connection(shard)
+                    with self._conns[shard] as conn:
+                        conn.executemany(
+                            "UPDATE files SET visits = visits + ? WHERE filename = ? AND user_id = ?",
+                            [(count, filename, user_id) for (filename, user_id), count in increments.items()]
+                        )
+                    unwritten.pop(0)
+            except Exception:
+                # Keep the increments of the shards not written yet for the next attempt
+                with self._lock:
+                    for _, increments in unwritten:
+                        self._pending.update(increments)
+                        self._pending_total += sum(increments.values())
+                raise
+            return sum(batch.values())
+
+    def stop(self):
+        thread = self._thread
+        if thread is not None:
+            self._thread = None
+            self._wakeup.set()
+            thread.join(timeout=5)
+        self.flush()
+
+    def _forget(self):
+        # The parent flushes its own increments, a forked child starts empty
+        # and keeps its hands off the parent's connection and flush thread
+        self._pending = Counter()
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._inherited_conns, self._conns = self._conns, {}
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while self._thread is not None:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Visit counter flush failed')
+
+
+counter = VisitCounter()
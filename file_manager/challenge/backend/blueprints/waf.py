@@ -0,0 +1,225 @@
+import os
+import re
+from collections import namedtuple
+from urllib.parse import unquote_plus
+
+# Content larger than this many UTF-8 bytes is rejected without being
+# scanned, with a 'scan_budget' hit
+WAF_MAX_SCAN_BYTES = int(os.environ.get('WAF_MAX_SCAN_BYTES', 8 * 1024 * 1024))
+
+WafHit = namedtuple('WafHit', ['rule', 'position'])
+
+_HTML_TAG = re.compile(r'<\s*[a-zA-Z]+(?:\s|>)', re.I)
+_IDENT_START = re.compile(r'[a-zA-Z_]', re.I)
+# Unfinished matches at the end of a piece, see the carry functions
+_TAG_OPENING = re.compile(r'<\s*([a-zA-Z]*)', re.I)
+_TRAILING_CALL = re.compile(r'([\s\/\\]*)(\w*)')
+_WHITESPACE = re.compile(r'\s')
+# Possessive quantifiers give up nothing here, backtracking can't find a '('
+_FUNCTION_CALL = re.compile(r'\b[a-zA-Z_]\w*+[\s\/\\]*+\(', re.I)
+# Above one '(' per this many characters the regex is cheaper than walking back
+_DENSE_PARENS = 16
+
+
+def find_html_tag(text):
+    r"""<\s*[a-zA-Z]+(?:\s|>) - html opening tags."""
+    match = _HTML_TAG.search(text)
+    return match.start() if match else None
+
+
+def find_function_call(text):
+    r"""\b[a-zA-Z_]\w*[\s\/\\]*\( - function calls.
+
+    Running the regex means trying a match at every word, which is slow on
+    ordinary prose. When '(' is rare, walk back from each one instead: skip the
+    separators, then the word before them must start with a letter or
+    underscore.
+    """
+    parens = text.count('(')
+    if parens == 0:
+        return None
+    if parens * _DENSE_PARENS > len(text):
+        match = _FUNCTION_CALL.search(text)
+        return match.start() if match else None
+
+    paren = text.find('(')
+    while paren != -1:
+        end = paren
+        while end > 0 and (text[end - 1].isspace() or text[end - 1] in '/\\'):
+            end -= 1
+        start = end
+        while start > 0 and (text[start - 1].isalnum() or text[start - 1] == '_'):
+            start -= 1
+        if start < end and _IDENT_START.match(text, start):
+            return start
+        paren = text.find('(', paren + 1)
+    return None
+
+
+def find_tag_with_whitespace(text):
+    r"""<[^>]*\s[^>]*> - html tags with attributes.
+
+    The regex backtracks quadratically on runs of unclosed '<'. Only the first
+    '<' after each '>' can start a match, since every later '<' in the same
+    run sees a subset of the same characters, so one forward walk is enough.
+    """
+    start = text.find('<')
+    while start != -1:
+        close = text.find('>', start)
+        if close == -1:
+            return None
+        if _WHITESPACE.search(text, start, close):
+            return start
+        start = text.find('<', close)
+    return None
+
+
+# Streaming scans feed the text in pieces. Each rule has a carry function that
+# sums up the end of the text seen so far as a short stand-in prefix, so a
+# match straddling two pieces is still found when the next piece arrives.
+
+def carry_html_tag(text):
+    """'<' or '<a' if text ends inside a possible tag opening."""
+    match = _TAG_OPENING.fullmatch(text, max(text.rfind('<'), 0))
+    if match is None:
+        return ''
+    return '<a' if match.group(1) else '<'
+
+
+def carry_tag_with_whitespace(text):
+    """'<' or '< ' if text ends inside an unclosed tag."""
+    start = text.find('<', text.rfind('>') + 1)
+    if start == -1:
+        return ''
+    return '< ' if _WHITESPACE.search(text, start) else '<'
+
+
+def carry_function_call(text):
+    """The validity of a trailing word, plus whether separators followed it."""
+    # Matched on the reversed text, regexes only run forwards
+    separators, word = _TRAILING_CALL.match(text[::-1]).groups()
+    if not word:
+        return ''
+    word = 'a' if _IDENT_START.match(word[-1]) else '1'
+    return word + ' ' if separators else word
+
+
+# Ordered cheapest first, the scan stops at the first rule that hits.
+# (name, find, carry)
+RULES = [
+    ('html_tag', find_html_tag, carry_html_tag),
+    ('tag_attributes', find_tag_with_whitespace, carry_tag_with_whitespace),
+    ('function_call', find_function_call, carry_function_call),
+]
+
+_HEX = frozenset('0123456789abcdefABCDEF')
+
+
+def _decode_boundary(text):
+    """Where text can be cut so unquote_plus decodes both halves the same.
+
+    A trailing partial escape is held back, and so is a percent-encoded UTF-8
+    sequence that may still be missing continuation bytes.
+    """
+    end = len(text)
+    if text.endswith('%'):
+        end -= 1
+    elif end >= 2 and text[-2] == '%' and text[-1] in _HEX:
+        end -= 2
+    cut = end
+    # A UTF-8 character is at most 4 bytes, look back over 4 escapes at most
+    for _ in range(4):
+        if cut < 3 or text[cut - 3] != '%' or text[cut - 2] not in _HEX or text[cut - 1] not in _HEX:
+            break
+        cut -= 3
+        byte = int(text[cut + 1:cut + 3], 16)
+        if byte < 0x80:
+            break
+        if byte >= 0xC0:
+            return cut
+    return end
+
+
+def utf8_size(text):
+    """Length of text in UTF-8 bytes, without encoding it if it's ASCII."""
+    if text.isascii():
+        return len(text)
+    # JSON escapes can produce lone surrogates, count them like any character
+    return len(text.encode('utf-8', 'surrogatepass'))
+
+
+class WafEngine:
+    """Precompiled xss filter with a bounded, linear scan cost."""
+
+    def __init__(self, rules=RULES, max_scan_bytes=WAF_MAX_SCAN_BYTES):
+        self.rules = rules
+        self.max_scan_bytes = max_scan_bytes
+
+    def decode(self, text):
+        # unquote_plus/lower copy the whole input, only pay for them when needed
+        if '%' in text or '+' in text:
+            text = unquote_plus(text)
+        if not text.isascii():
+            text = text.lower()
+        return text
+
+    def scan(self, text):
+        """Return the first WafHit in text, or None if it looks clean."""
+        # At most four bytes per character, only count them near the limit
+        if len(text) * 4 > self.max_scan_bytes and utf8_size(text) > self.max_scan_bytes:
+            return WafHit('scan_budget', self.max_scan_bytes)
+
+        text = self.decode(text)
+        for name, rule, _ in self.rules:
+            position = rule(text)
+            if position is not None:
+                return WafHit(name, position)
+        return None
+
+    def stream(self, max_scan_bytes=None):
+        return StreamScanner(self, max_scan_bytes or self.max_scan_bytes)
+
+
+class StreamScanner:
+    """Incremental WafEngine.scan for text that arrives in pieces.
+
+    Feeding a text in any number of pieces finds a hit exactly when scanning
+    it in one go would. Only a few characters are kept between pieces, so
+    memory stays flat however large the text gets.
+    """
+
+    def __init__(self, engine, max_scan_bytes):
+        self.engine = engine
+        self.max_scan_bytes = max_scan_bytes
+        self.hit = None
+        self._scanned = 0
+        self._offset = 0
+        self._held = ''
+        self._carry = [''] * len(engine.rules)
+
+    def feed(self, text, final=False):
+        """Scan the next piece, returns the first WafHit once there is one."""
+        if self.hit:
+            return self.hit
+        self._scanned += utf8_size(text)
+        if self._scanned > self.max_scan_bytes:
+            self.hit = WafHit('scan_budget', self.max_scan_bytes)
+            return self.hit
+
+        text = self._held + text
+        cut = len(text) if final else _decode_boundary(text)
+        text, self._held = self.engine.decode(text[:cut]), text[cut:]
+
+        for index, (name, rule, carry) in enumerate(self.engine.rules):
+            prefix = self._carry[index]
+            piece = prefix + text
+            position = rule(piece)
+            if position is not None:
+                self.hit = WafHit(name, self._offset + max(position - len(prefix), 0))
+                return self.hit
+            self._carry[index] = carry(piece)
+        self._offset += len(text)
+        return None
+
+
+engine = WafEngine()
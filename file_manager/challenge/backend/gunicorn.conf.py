@@ -0,0 +1,74 @@
+"""Gunicorn settings for serving the backend.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once, in the master, before any worker is forked: the
+schema migrations run once, the report workers are started once and every
+worker shares the session secret key. Each worker then gets its own sqlite
+pool, visit counter, log writer and password hashing processes (the modules
+reset their state at fork, post_fork starts the hashers).
+
+Request metrics are counted per worker, which writes them to METRICS_DIR
+every METRICS_FLUSH_INTERVAL seconds. /metrics on any worker adds up all
+of them, and a worker that exits has its counters kept by the master.
+
+`kill -HUP <master pid>` replaces the workers gracefully: new ones are forked
+from the preloaded app and the old ones finish their requests first. Code
+changes need a new master, `kill -USR2` then `kill -QUIT` the old one.
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+# Worker processes and request threads in each of them. Threads beyond
+# DB_POOL_SIZE just wait for a connection.
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+# Seconds a worker may go silent before it is killed, and the time a
+# stopping worker gets to finish its requests
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+
+# Not optional: without it every worker would run the migrations and start
+# its own set of report workers, each with its own secret key
+preload_app = True
+
+
+def when_ready(server):
+    # The master doesn't serve requests, its hashing processes would sit idle
+    from blueprints.passwords import hasher
+    hasher.shutdown()
+    # Nor its log writer thread, the workers are forked next
+    from blueprints.logs import stop as stop_log_writer
+    stop_log_writer()
+
+
+def post_fork(server, worker):
+    # Fork the hashing processes before the worker starts its threads
+    from blueprints.passwords import hasher
+    hasher.start()
+    from blueprints.logs import start as start_log_writer
+    start_log_writer()
+
+
+def on_exit(server):
+    # The report workers were forked by the master, it stops them
+    from blueprints.report_queue import stop_workers
+    stop_workers()
+
+
+def worker_exit(server, worker):
+    # Leave the final numbers for the master to keep
+    from blueprints.metrics import publish
+    publish()
+
+
+def child_exit(server, worker):
+    from blueprints.metrics import retire
+    retire(worker.pid)